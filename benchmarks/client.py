@@ -0,0 +1,14 @@
+from contextlib import asynccontextmanager
+
+import httpx
+
+from main import app
+
+
+@asynccontextmanager
+async def app_client(timeout=None):
+    """An httpx client bound to the app in-process, with the app lifespan running"""
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            yield client
@@ -0,0 +1,113 @@
+"""Database queries saved by coalescing identical reads of a hot incident.
+
+Simulates a crowd opening the same incident page: waves of concurrent
+GETs for the incident, its timeline and its postmortem. The read caches are
+cleared before every wave, so each wave is what a cold or just-updated incident
+costs. The same waves run with coalescing off and on, and the queries that
+reached MongoDB are compared:
+
+    python -m benchmarks.coalescing --clients 200 --waves 5
+
+Requires httpx in addition to the app requirements.
+"""
+import argparse
+import asyncio
+import time
+
+from pymongo import monitoring
+
+
+class QueryCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.queries = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate"):
+            self.queries += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = QueryCounter()
+monitoring.register(counter)
+
+from benchmarks.client import app_client  # noqa: E402  (the listener must exist before the client)
+from benchmarks.stats import summarize  # noqa: E402
+from database.cache import incident_cache, postmortem_cache  # noqa: E402
+from database.coalesce import reads  # noqa: E402
+
+
+async def wave(client, incident_id: str, clients: int) -> list:
+    """One page load per client, all at once; returns the latency of each in ms"""
+    async def page_load():
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            client.get(f"/api/incidents/{incident_id}"),
+            client.get(f"/api/timeline/{incident_id}"),
+            client.get(f"/api/postmortem/{incident_id}")
+        )
+        for response in responses:
+            response.raise_for_status()
+        return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(page_load() for _ in range(clients)))
+
+
+async def measure(client, incident_id: str, clients: int, waves: int, coalesce: bool) -> dict:
+    reads.enabled = coalesce
+    latencies = []
+    counter.queries = 0
+    for _ in range(waves):
+        await incident_cache.clear()
+        await postmortem_cache.clear()
+        latencies += await wave(client, incident_id, clients)
+    return {"queries_per_wave": counter.queries / waves, **summarize(latencies)}
+
+
+async def run(clients: int, waves: int, events: int):
+    async with app_client() as client:
+        created = await client.post("/api/incidents/", json={
+            "title": "Coalescing benchmark",
+            "description": "Seeded by benchmarks.coalescing",
+            "severity": "Critical"
+        })
+        incident_id = created.json()["data"]["id"]
+        await client.post("/api/timeline/bulk", json=[{
+            "incident_id": incident_id,
+            "event_type": "Investigation",
+            "description": f"Update {i}"
+        } for i in range(events)])
+        await client.post(f"/api/postmortem/{incident_id}/rca", params={"root_cause": "Benchmark"})
+
+        try:
+            results = {
+                "off": await measure(client, incident_id, clients, waves, coalesce=False),
+                "on": await measure(client, incident_id, clients, waves, coalesce=True)
+            }
+        finally:
+            reads.enabled = True
+            await client.delete(f"/api/incidents/{incident_id}")
+
+    print(f"{clients} concurrent page loads x {waves} waves, {events} timeline events")
+    for mode, result in results.items():
+        print(f"coalescing {mode:3}: {result['queries_per_wave']:7.1f} queries/wave  "
+              f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms")
+    saved = 1 - results["on"]["queries_per_wave"] / results["off"]["queries_per_wave"]
+    print(f"queries saved: {saved:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--waves", type=int, default=5)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.clients, args.waves, args.events))
+
+
+if __name__ == "__main__":
+    main()
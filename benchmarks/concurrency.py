@@ -0,0 +1,64 @@
+"""Concurrency benchmark for the incident read path.
+
+Drives the app in-process through an ASGI client with many concurrent clients
+and reports latency percentiles. Run it against the same MONGODB_URI before and
+after a change to compare p99 latency:
+
+    python -m benchmarks.concurrency --clients 200 --requests 20
+
+Requires httpx in addition to the app requirements.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.client import app_client
+from benchmarks.stats import percentile
+
+
+async def client_worker(client: httpx.AsyncClient, path: str, requests: int, latencies: list):
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+
+
+async def run(clients: int, requests: int):
+    async with app_client() as client:
+        created = await client.post("/api/incidents/", json={
+            "title": "Benchmark incident",
+            "description": "Seeded by benchmarks.concurrency"
+        })
+        incident_id = created.json()["data"]["id"]
+        path = f"/api/incidents/{incident_id}"
+
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client_worker(client, path, requests, latencies) for _ in range(clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+        await client.delete(path)
+
+    print(f"clients={clients} requests={len(latencies)} elapsed={elapsed:.2f}s "
+          f"throughput={len(latencies) / elapsed:.1f} req/s")
+    print(f"p50={statistics.median(latencies):.1f}ms "
+          f"p95={percentile(latencies, 95):.1f}ms "
+          f"p99={percentile(latencies, 99):.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    args = parser.parse_args()
+    asyncio.run(run(args.clients, args.requests))
+
+
+if __name__ == "__main__":
+    main()
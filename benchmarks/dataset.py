@@ -0,0 +1,119 @@
+"""Synthetic dataset for the load-testing suite.
+
+Incidents are spread over the last 90 days with a realistic severity and status
+mix. Timeline lengths follow a Pareto distribution, so most incidents have a
+handful of events and a few have thousands. Most resolved incidents get a
+postmortem. Every document is tagged so it can be removed afterwards, and a
+fixed seed makes the dataset reproducible.
+"""
+import random
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+import config
+from database import repository
+
+RUN_TAG = "benchmarks.load"
+BATCH = 5000
+MAX_EVENTS_PER_INCIDENT = 5000
+
+SEVERITIES = (["Critical", "High", "Medium", "Low"], [5, 20, 45, 30])
+STATUSES = (["Open", "In Progress", "Resolved", "Closed"], [10, 15, 25, 50])
+SERVICES = ["checkout", "payments", "search", "auth", "inventory", "shipping", "notifications", "billing"]
+SYMPTOMS = ["timeout", "latency spike", "error rate", "memory leak", "connection pool exhaustion",
+            "certificate expiry", "disk full", "replication lag", "deadlock", "rate limiting"]
+CAUSES = ["bad deploy", "config change", "expired certificate", "noisy neighbour", "schema migration",
+          "dependency outage", "traffic surge", "cache stampede"]
+
+
+def _timeline(rng: random.Random, incident_id: str, created_at: datetime, resolved_at, count: int) -> list:
+    end = resolved_at or created_at + timedelta(hours=rng.uniform(1, 48))
+    step = (end - created_at) / max(count, 1)
+    events = []
+    for i in range(count):
+        if i == 0:
+            event_type = "Detection"
+        elif resolved_at and i == count - 1:
+            event_type = "Resolution"
+        elif i == count // 2:
+            event_type = "Mitigation"
+        else:
+            event_type = "Investigation"
+        events.append({
+            "incident_id": incident_id,
+            "event_type": event_type,
+            "description": f"{event_type}: {rng.choice(SYMPTOMS)} in {rng.choice(SERVICES)}",
+            "timestamp": created_at + step * i,
+            "created_by": rng.choice(["pagerduty", "slackbot", "oncall", "system"]),
+            "benchmark_run": RUN_TAG
+        })
+    return events
+
+
+async def seed(incidents: int, seed: int = 42) -> dict:
+    """Insert the dataset and return the seeded incident IDs with their timeline sizes"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    seeded = {}
+    for offset in range(0, incidents, BATCH):
+        batch, timelines = [], []
+        for _ in range(offset, min(incidents, offset + BATCH)):
+            created_at = now - timedelta(minutes=rng.uniform(0, 90 * 24 * 60))
+            status = rng.choices(*STATUSES)[0]
+            resolved_at = None
+            if status in ("Resolved", "Closed"):
+                resolved_at = created_at + timedelta(minutes=rng.lognormvariate(4, 1))
+            service, symptom = rng.choice(SERVICES), rng.choice(SYMPTOMS)
+            event_count = min(MAX_EVENTS_PER_INCIDENT, int(rng.paretovariate(1.2) * 3))
+            batch.append({
+                "title": f"{service} {symptom}",
+                "description": f"Customers saw {symptom} on {service} after {rng.choice(CAUSES)}",
+                "severity": rng.choices(*SEVERITIES)[0],
+                "status": status,
+                "created_at": created_at,
+                "updated_at": resolved_at or created_at,
+                "resolved_at": resolved_at,
+                "timeline_version": event_count,
+                "benchmark_run": RUN_TAG
+            })
+            timelines.append(event_count)
+        await config.incidents_collection.insert_many(batch)
+
+        events, postmortems = [], []
+        for incident, event_count in zip(batch, timelines):
+            incident_id = str(incident["_id"])
+            seeded[incident_id] = event_count
+            events += _timeline(rng, incident_id, incident["created_at"], incident["resolved_at"], event_count)
+            if incident["resolved_at"] and rng.random() < 0.6:
+                postmortems.append({
+                    "incident_id": incident_id,
+                    "root_cause": rng.choice(CAUSES),
+                    "contributing_factors": rng.sample(SYMPTOMS, 2),
+                    "impact": f"{rng.randint(1, 100)}% of {incident['title'].split()[0]} requests failed",
+                    "action_items": ["Add alerting", "Write runbook"],
+                    "created_at": incident["resolved_at"],
+                    "updated_at": incident["resolved_at"],
+                    "benchmark_run": RUN_TAG
+                })
+        for start in range(0, len(events), BATCH):
+            await config.timeline_collection.insert_many(events[start:start + BATCH])
+        if postmortems:
+            await config.postmortem_collection.insert_many(postmortems)
+        await repository.refresh_incident_summaries(*(str(incident["_id"]) for incident in batch))
+    return seeded
+
+
+async def cleanup(incident_ids=(), job_ids=()):
+    """Remove the seeded documents, plus anything written through the API for these incidents and jobs"""
+    for collection in (config.incidents_collection, config.timeline_collection, config.postmortem_collection):
+        await collection.delete_many({"benchmark_run": RUN_TAG})
+    incident_ids = list(incident_ids)
+    for start in range(0, len(incident_ids), BATCH):
+        chunk = incident_ids[start:start + BATCH]
+        await config.timeline_collection.delete_many({"incident_id": {"$in": chunk}})
+        await config.postmortem_collection.delete_many({"incident_id": {"$in": chunk}})
+        await config.revisions_collection.delete_many({"incident_id": {"$in": chunk}})
+        await config.incidents_collection.delete_many({"_id": {"$in": [ObjectId(i) for i in chunk]}})
+    if job_ids:
+        await config.jobs_collection.delete_many({"_id": {"$in": [ObjectId(i) for i in job_ids]}})
@@ -0,0 +1,292 @@
+"""Load-testing suite covering every router endpoint.
+
+Seeds a synthetic dataset (see benchmarks/dataset.py), then drives each
+endpoint with concurrent clients through an in-process ASGI client and reports
+throughput, p50/p95/p99 latency and MongoDB round trips per request.
+Scenarios that edit or delete documents work on ones created by earlier
+scenarios, so they only produce 404s when run on their own with --only. The
+timeline stream is measured to its first message. Results are written as JSON
+so runs can be compared across commits:
+
+    MONGODB_URI=mongodb://localhost:27017 MONGODB_TLS=false \\
+        python -m benchmarks.load --incidents 10000 --concurrency 50 --requests 500 \\
+        --output benchmark_results.json --compare previous.json
+
+The suite needs a real mongod (for example `docker run -p 27017:27017 mongo`);
+mongomock cannot run the aggregation, $lookup and $text queries the API relies
+on. Requires httpx in addition to the app requirements.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+
+class RequestCounter:
+    def __init__(self):
+        self.commands = 0
+
+
+current_counter: ContextVar = ContextVar("current_counter", default=None)
+
+
+class RoundTripListener(monitoring.CommandListener):
+    """Attributes each command to the benchmark request running in the current context"""
+
+    def started(self, event):
+        counter = current_counter.get()
+        if counter is not None:
+            counter.commands += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+monitoring.register(RoundTripListener())
+
+from benchmarks import dataset  # noqa: E402  (the listener must exist before the client)
+from benchmarks.client import app_client  # noqa: E402
+from benchmarks.stats import summarize  # noqa: E402
+from main import app  # noqa: E402
+
+MISSING_ID = "0" * 24
+
+
+def scenarios(rng: random.Random, incident_ids: list, created: dict) -> list:
+    """(name, method, request factory, recorder) for every endpoint
+
+    Factories return (path, kwargs). A recorder, if any, notes the documents a
+    successful response created in created, for cleanup and later scenarios.
+    """
+    def incident():
+        return rng.choice(incident_ids)
+
+    def pop(kind):
+        return created[kind].pop() if created[kind] else None
+
+    def created_event():
+        return rng.choice(created["events"]) if created["events"] else (MISSING_ID, incident())
+
+    def replace_event():
+        event_id, incident_id = created_event()
+        return f"/api/timeline/{event_id}", {"json": event(incident_id)}
+
+    def delete_event():
+        event_id, _ = pop("events") or (MISSING_ID, None)
+        return f"/api/timeline/{event_id}", {}
+
+    def record_incident(body):
+        created["incidents"].append(body["data"]["id"])
+
+    def record_incidents(body):
+        created["incidents"].extend(result["data"]["id"] for result in body["data"] if result["status"] == "created")
+
+    def record_event(body):
+        created["events"].append((body["data"]["id"], body["data"]["incident_id"]))
+
+    def record_events(body):
+        created["events"].extend(
+            (result["data"]["id"], result["data"]["incident_id"]) for result in body["data"] if result["status"] == "created"
+        )
+
+    def record_job(body):
+        created["jobs"].append(body["job"]["id"])
+
+    def incidents(count):
+        return rng.sample(incident_ids, min(count, len(incident_ids)))
+
+    def event(incident_id):
+        return {"incident_id": incident_id, "event_type": "Investigation", "description": "Load test update"}
+
+    return [
+        ("root", "GET", lambda: ("/", {}), None),
+        ("health_live", "GET", lambda: ("/health/live", {}), None),
+        ("health_ready", "GET", lambda: ("/health/ready", {}), None),
+        ("metrics", "GET", lambda: ("/metrics", {}), None),
+        ("list_incidents", "GET", lambda: ("/api/incidents/", {"params": {"limit": 50}}), None),
+        ("list_incidents_filtered", "GET", lambda: ("/api/incidents/", {"params": {"status": "Open", "severity": "High"}}), None),
+        ("get_incident", "GET", lambda: (f"/api/incidents/{incident()}", {}), None),
+        ("create_incident", "POST", lambda: ("/api/incidents/", {"json": {"title": "Load test", "description": "Created by benchmarks.load"}}), record_incident),
+        ("get_incidents_batch", "GET", lambda: ("/api/incidents/batch", {"params": {"ids": ",".join(incidents(50))}}), None),
+        ("create_incidents_bulk", "POST", lambda: ("/api/incidents/bulk", {"json": [{"title": "Load test", "description": "Created by benchmarks.load"}] * 20}), record_incidents),
+        ("update_incidents_status_bulk", "PATCH", lambda: ("/api/incidents/bulk", {"json": {"ids": incidents(20), "status": "In Progress"}}), None),
+        ("update_incident", "PUT", lambda: (f"/api/incidents/{incident()}", {"json": {"title": "Load test", "description": "Updated", "status": "In Progress"}}), None),
+        ("patch_incident", "PATCH", lambda: (f"/api/incidents/{incident()}", {"json": {"status": "In Progress"}}), None),
+        ("delete_incident", "DELETE", lambda: (f"/api/incidents/{pop('incidents') or MISSING_ID}", {}), None),
+        ("get_timeline", "GET", lambda: (f"/api/timeline/{incident()}", {}), None),
+        ("get_timeline_summary", "GET", lambda: (f"/api/timeline/{incident()}/summary", {"params": {"bucket": "5m"}}), None),
+        ("stream_timeline", "STREAM", lambda: (f"/api/timeline/{incident()}/stream", {}), None),
+        ("add_timeline_event", "POST", lambda: ("/api/timeline/", {"json": event(incident())}), record_event),
+        ("add_timeline_events_bulk", "POST", lambda: ("/api/timeline/bulk", {"json": [event(incident()) for _ in range(50)]}), record_events),
+        ("update_timeline_event", "PUT", replace_event, None),
+        ("patch_timeline_event", "PATCH", lambda: (f"/api/timeline/{created_event()[0]}", {"json": {"description": "Patched by load test"}}), None),
+        ("delete_timeline_event", "DELETE", delete_event, None),
+        ("get_postmortem", "GET", lambda: (f"/api/postmortem/{incident()}", {}), None),
+        ("get_postmortem_report", "GET", lambda: (f"/api/postmortem/{incident()}/report", {"params": {"timeline_limit": 100}}), None),
+        ("generate_rca", "POST", lambda: (f"/api/postmortem/{incident()}/rca", {"params": {"root_cause": "Load test"}}), None),
+        ("add_contributing_factors", "POST", lambda: (f"/api/postmortem/{incident()}/factors", {"json": ["Load test factor"]}), None),
+        ("generate_final_postmortem", "POST", lambda: (f"/api/postmortem/{incident()}/generate", {"params": {"impact": "None", "timeline_limit": 100}, "json": ["Review"]}), None),
+        ("get_postmortem_revisions", "GET", lambda: (f"/api/postmortem/{incident()}/revisions", {}), None),
+        ("get_postmortem_revision", "GET", lambda: (f"/api/postmortem/{incident()}/revisions/1", {}), None),
+        ("export_postmortems", "GET", lambda: ("/api/postmortem/export", {"params": {"format": "jsonl", "timeline_limit": 20, "from": (datetime.now() - timedelta(days=7)).isoformat()}}), None),
+        ("analytics_incident_counts", "GET", lambda: ("/api/analytics/incident-counts", {"params": {"bucket": "week"}}), None),
+        ("analytics_mttr", "GET", lambda: ("/api/analytics/mttr", {"params": {"group_by": "severity"}}), None),
+        ("analytics_response_times", "GET", lambda: ("/api/analytics/response-times", {}), None),
+        ("search", "GET", lambda: ("/api/search", {"params": {"q": rng.choice(dataset.SYMPTOMS)}}), None),
+        # Nothing is old enough to archive, so this measures starting and running an empty job
+        ("archive_incidents", "POST", lambda: ("/api/incidents/archive", {"params": {"older_than_days": 36500}}), record_job),
+        ("list_jobs", "GET", lambda: ("/api/jobs/", {}), None),
+        ("get_job", "GET", lambda: (f"/api/jobs/{rng.choice(created['jobs']) if created['jobs'] else MISSING_ID}", {}), None),
+    ]
+
+
+async def stream_first_message(path: str) -> int:
+    """Open an event stream, wait for its first message and disconnect; returns the status
+
+    Goes through the raw ASGI interface, as httpx's ASGI transport waits for the
+    whole body, which a stream never finishes.
+    """
+    status = 500
+    received = asyncio.Event()
+
+    async def receive():
+        await received.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and (message.get("body") or not message.get("more_body")):
+            received.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80)
+    }
+    await app(scope, receive, send)
+    return status
+
+
+async def run_scenario(client, method: str, factory, record, requests: int, concurrency: int) -> dict:
+    latencies, round_trips = [], []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            path, kwargs = factory()
+            counter = RequestCounter()
+            token = current_counter.set(counter)
+            start = time.perf_counter()
+            response = None
+            try:
+                if method == "STREAM":
+                    status_code = await stream_first_message(path)
+                else:
+                    response = await client.request(method, path, **kwargs)
+                    status_code = response.status_code
+            finally:
+                current_counter.reset(token)
+            latencies.append((time.perf_counter() - start) * 1000)
+            round_trips.append(counter.commands)
+            if status_code >= 400 and status_code != 404:
+                errors += 1
+            elif record and status_code < 300:
+                record(response.json())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        **summarize(latencies),
+        "db_round_trips_mean": round(sum(round_trips) / len(round_trips), 2),
+        "db_round_trips_max": max(round_trips)
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def compare(results: dict, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)["results"]
+    print(f"\n{'scenario':32} {'p99 before':>11} {'p99 after':>10} {'change':>8}")
+    for name, result in results.items():
+        before = previous.get(name, {}).get("p99_ms")
+        if before and result["p99_ms"]:
+            print(f"{name:32} {before:>11.1f} {result['p99_ms']:>10.1f} {(result['p99_ms'] / before - 1) * 100:>+7.0f}%")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    created = {"incidents": [], "events": [], "jobs": []}
+    results = {}
+    async with app_client() as client:
+        start = time.perf_counter()
+        seeded = await dataset.seed(args.incidents, args.seed)
+        print(f"seeded {len(seeded)} incidents, {sum(seeded.values())} timeline events "
+              f"in {time.perf_counter() - start:.1f}s")
+        incident_ids = list(seeded)
+        try:
+            print(f"{'scenario':32} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'db/req':>7} {'errors':>6}")
+            for name, method, factory, record in scenarios(rng, incident_ids, created):
+                if args.only and name not in args.only:
+                    continue
+                result = await run_scenario(client, method, factory, record, args.requests, args.concurrency)
+                results[name] = result
+                print(f"{name:32} {result['throughput_rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                      f"{result['p99_ms']:>8.1f} {result['db_round_trips_mean']:>7.2f} {result['errors']:>6}")
+        finally:
+            await dataset.cleanup(incident_ids + created["incidents"], created["jobs"])
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "parameters": {
+            "incidents": args.incidents,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--incidents", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Previous results file to compare p99 latency against")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Storage and read cost of postmortem history as snapshots plus deltas.
+
+Makes a series of edits to one postmortem through the API, alternating root
+cause rewrites with added contributing factors, so the history grows the way
+a postmortem under review does. Alongside, a full copy of the postmortem after
+every edit is written to a scratch collection. The two histories are compared
+on stored size and on the latency of reading back a revision, both measured
+at the database layer: fetching and replaying the revision chain the endpoint
+uses, against fetching the full copy.
+
+    python -m benchmarks.revisions --edits 200 --factors 5 --reads 200
+
+Requires httpx in addition to the app requirements.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import bson
+
+import config
+from benchmarks.client import app_client
+from benchmarks.stats import summarize
+from database import repository
+from database.revisions import SNAPSHOT_INTERVAL, postmortem_state, rebuild
+
+FULL_COPY_COLLECTION = "postmortem_revisions_full_copy_benchmark"
+
+
+async def edit(client, incident_id: str, number: int, factors: int) -> dict:
+    if number % 2:
+        response = await client.post(f"/api/postmortem/{incident_id}/factors", json=[
+            f"Factor {number}-{i}: " + "detail " * 10 for i in range(factors)
+        ])
+    else:
+        response = await client.post(f"/api/postmortem/{incident_id}/rca", params={
+            "root_cause": f"Root cause as of edit {number}: " + "analysis " * 40
+        })
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+async def read_latencies(read, revisions: list) -> list:
+    latencies = []
+    for revision in revisions:
+        start = time.perf_counter()
+        await read(revision)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def run(edits: int, factors: int, reads: int):
+    async with app_client() as client:
+        created = await client.post("/api/incidents/", json={
+            "title": "Revisions benchmark",
+            "description": "Seeded by benchmarks.revisions",
+            "severity": "Medium"
+        })
+        incident_id = created.json()["data"]["id"]
+        full_copies = config.db[FULL_COPY_COLLECTION]
+        await full_copies.create_index([("incident_id", 1), ("revision", 1)], unique=True)
+
+        try:
+            for number in range(edits):
+                postmortem = await edit(client, incident_id, number, factors)
+                await full_copies.insert_one({
+                    "incident_id": incident_id,
+                    "revision": postmortem["revision"],
+                    "snapshot": postmortem_state(postmortem)
+                })
+
+            delta_documents = await config.revisions_collection.find({"incident_id": incident_id}).to_list(None)
+            full_documents = await full_copies.find({"incident_id": incident_id}).to_list(None)
+            delta_bytes = sum(len(bson.encode(document)) for document in delta_documents)
+            full_bytes = sum(len(bson.encode(document)) for document in full_documents)
+
+            # Reading the same revision for both keeps the comparison fair
+            sample = [random.randint(1, edits) for _ in range(reads)]
+
+            async def read_rebuilt(revision):
+                state = rebuild(await repository.find_revision_chain(incident_id, revision), revision)
+                assert state is not None, f"revision {revision} could not be rebuilt"
+
+            async def read_full_copy(revision):
+                await full_copies.find_one({"incident_id": incident_id, "revision": revision})
+
+            rebuilt = summarize(await read_latencies(read_rebuilt, sample))
+            copied = summarize(await read_latencies(read_full_copy, sample))
+        finally:
+            await full_copies.drop()
+            await client.delete(f"/api/incidents/{incident_id}")
+
+    print(f"{edits} edits, {factors} factors per factor edit, snapshot every {SNAPSHOT_INTERVAL} revisions")
+    print(f"snapshots + deltas: {delta_bytes:>10} bytes  {delta_bytes / edits:8.0f} bytes/revision")
+    print(f"full copies:        {full_bytes:>10} bytes  {full_bytes / edits:8.0f} bytes/revision")
+    print(f"storage saved: {1 - delta_bytes / full_bytes:.0%}")
+    print(f"chain + rebuild:         p50={rebuilt['p50_ms']}ms p99={rebuilt['p99_ms']}ms")
+    print(f"find_one (full copy):    p50={copied['p50_ms']}ms p99={copied['p99_ms']}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--factors", type=int, default=5)
+    parser.add_argument("--reads", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.edits, args.factors, args.reads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Count database round trips per request for the write endpoints.
+
+Registers a PyMongo command listener before the app's client is created, then
+calls each endpoint once through an ASGI client and reports how many commands
+it sent to Mongo:
+
+    python -m benchmarks.round_trips
+
+Requires httpx in addition to the app requirements.
+"""
+import asyncio
+
+import httpx
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+monitoring.register(counter)
+
+from benchmarks.client import app_client  # noqa: E402  (the listener must exist before the client)
+
+
+async def measure(client: httpx.AsyncClient, method: str, path: str, **kwargs) -> list:
+    counter.commands.clear()
+    response = await client.request(method, path, **kwargs)
+    response.raise_for_status()
+    return list(counter.commands)
+
+
+async def run():
+    async with app_client() as client:
+        counter.commands.clear()
+        created = await client.post("/api/incidents/", json={
+            "title": "Round trip benchmark",
+            "description": "Seeded by benchmarks.round_trips"
+        })
+        print(f"{'POST':6} {'/api/incidents/':60} round_trips={len(counter.commands)} {counter.commands}")
+        incident_id = created.json()["data"]["id"]
+
+        counter.commands.clear()
+        event = await client.post("/api/timeline/", json={
+            "incident_id": incident_id,
+            "event_type": "Detection",
+            "description": "Alert fired"
+        })
+        print(f"{'POST':6} {'/api/timeline/':60} round_trips={len(counter.commands)} {counter.commands}")
+        event_id = event.json()["data"]["id"]
+
+        scenarios = [
+            ("PUT", f"/api/incidents/{incident_id}", {"json": {
+                "title": "Round trip benchmark",
+                "description": "Seeded by benchmarks.round_trips",
+                "status": "Resolved"
+            }}),
+            ("PUT", f"/api/timeline/{event_id}", {"json": {
+                "incident_id": incident_id,
+                "event_type": "Detection",
+                "description": "Alert fired for checkout latency"
+            }}),
+            ("POST", f"/api/postmortem/{incident_id}/rca", {"params": {"root_cause": "Expired certificate"}}),
+            ("POST", f"/api/postmortem/{incident_id}/rca", {"params": {"root_cause": "Expired TLS certificate"}}),
+            ("POST", f"/api/postmortem/{incident_id}/factors", {"json": ["No expiry alerting", "Manual rotation"]}),
+            ("POST", f"/api/postmortem/{incident_id}/generate",
+             {"params": {"impact": "Checkout unavailable"}, "json": ["Automate rotation"]}),
+            ("GET", f"/api/postmortem/{incident_id}", {}),
+            ("GET", f"/api/postmortem/{incident_id}/report", {"params": {"timeline_limit": 50}}),
+        ]
+        for method, path, kwargs in scenarios:
+            commands = await measure(client, method, path, **kwargs)
+            print(f"{method:6} {path:60} round_trips={len(commands)} {commands}")
+
+        await client.delete(f"/api/incidents/{incident_id}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+"""Latency benchmark for GET /api/search over a synthetic corpus.
+
+Seeds N incidents (default 100k) with the load-testing dataset, runs a set of
+queries through an ASGI client and reports latency percentiles, then removes
+the seeded documents:
+
+    python -m benchmarks.search --incidents 100000 --rounds 20
+
+Point MONGODB_URI at a scratch database. Requires httpx in addition to the
+app requirements.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import dataset
+from benchmarks.client import app_client
+from benchmarks.stats import percentile
+
+QUERIES = ["timeout", "certificate expiry", "checkout latency", "\"connection pool\"", "deadlock payments",
+           "replication lag inventory", "cache stampede"]
+
+
+async def run(count: int, rounds: int):
+    # The app lifespan connects to the database and creates the text indexes
+    async with app_client() as client:
+        start = time.perf_counter()
+        seeded = await dataset.seed(count)
+        print(f"seeded {count} incidents in {time.perf_counter() - start:.1f}s")
+        try:
+            for query in QUERIES:
+                latencies = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    response = await client.get("/api/search", params={"q": query})
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    response.raise_for_status()
+                print(f"{query:30} hits={response.json()['total']:>4} "
+                      f"p50={statistics.median(latencies):.1f}ms p95={percentile(latencies, 95):.1f}ms")
+        finally:
+            await dataset.cleanup(seeded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--incidents", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.incidents, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
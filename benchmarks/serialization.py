@@ -0,0 +1,86 @@
+"""Micro-benchmark for response serialization.
+
+Compares the previous path (per-document serializer, jsonable_encoder and the
+stdlib json encoder used by JSONResponse) with the current one (bulk serializer
+rendered by orjson) on synthetic incident and timeline documents:
+
+    python -m benchmarks.serialization --sizes 1000 10000 100000
+
+Needs no database.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import orjson
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from database.schemas import (
+    incident_serializer, incidents_serializer, timeline_event_serializer, timeline_events_serializer
+)
+
+
+def make_incidents(count: int) -> list:
+    now = datetime.now()
+    return [{
+        "_id": ObjectId(),
+        "title": f"Incident {i}",
+        "description": "Elevated error rates on the checkout service " * 4,
+        "severity": "High",
+        "status": "Resolved",
+        "created_at": now - timedelta(minutes=i),
+        "updated_at": now,
+        "resolved_at": now
+    } for i in range(count)]
+
+
+def make_events(count: int) -> list:
+    now = datetime.now()
+    incident_id = str(ObjectId())
+    return [{
+        "_id": ObjectId(),
+        "incident_id": incident_id,
+        "event_type": "Investigation",
+        "description": "Checked dashboards and recent deploys " * 4,
+        "timestamp": now + timedelta(seconds=i),
+        "created_by": "responder"
+    } for i in range(count)]
+
+
+def previous(serializer, documents: list) -> bytes:
+    content = jsonable_encoder({"data": [serializer(document) for document in documents]})
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def current(bulk_serializer, documents: list) -> bytes:
+    return orjson.dumps({"data": bulk_serializer(documents)})
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    cases = [
+        ("incidents", make_incidents, incident_serializer, incidents_serializer),
+        ("timeline", make_events, timeline_event_serializer, timeline_events_serializer),
+    ]
+    print(f"{'documents':>10} {'kind':>10} {'previous ms':>12} {'current ms':>11} {'speedup':>8}")
+    for size in args.sizes:
+        for kind, factory, serializer, bulk_serializer in cases:
+            documents = factory(size)
+            before = timed(previous, serializer, documents)
+            after = timed(current, bulk_serializer, documents)
+            print(f"{size:>10} {kind:>10} {before:>12.1f} {after:>11.1f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
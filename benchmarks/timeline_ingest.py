@@ -0,0 +1,137 @@
+"""Throughput benchmark for timeline ingestion.
+
+Posts the same number of events through the single-event endpoint, through
+the same endpoint with ?async=true (write-behind) and through
+POST /api/timeline/bulk, spread over several incidents, and reports events/s.
+The write-behind run also checks that each incident's timeline comes back in
+the order its events were accepted:
+
+    python -m benchmarks.timeline_ingest --events 2000 --incidents 5 --batch 500
+
+Requires httpx in addition to the app requirements.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.client import app_client
+from services.ingest_queue import ingest_queue
+
+
+def make_events(incident_ids: list, count: int) -> list:
+    return [{
+        "incident_id": incident_ids[i % len(incident_ids)],
+        "event_type": "Investigation",
+        "description": f"Bot update {i}",
+        "created_by": "benchmark"
+    } for i in range(count)]
+
+
+async def single(client: httpx.AsyncClient, events: list, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(event):
+        async with semaphore:
+            response = await client.post("/api/timeline/", json=event)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(post(event) for event in events))
+    return time.perf_counter() - start
+
+
+async def write_behind(client: httpx.AsyncClient, events: list, concurrency: int) -> tuple:
+    """Post events with ?async=true; returns (seconds until accepted, seconds until written)
+
+    Events for the same incident are posted one after another so their
+    acceptance order is known; different incidents are posted concurrently.
+    """
+    by_incident = {}
+    for event in events:
+        by_incident.setdefault(event["incident_id"], []).append(event)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post_all(incident_events):
+        async with semaphore:
+            for event in incident_events:
+                while True:
+                    response = await client.post("/api/timeline/", params={"async": "true"}, json=event)
+                    if response.status_code != 429:
+                        break
+                    await asyncio.sleep(0.05)
+                response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(post_all(incident_events) for incident_events in by_incident.values()))
+    accepted = time.perf_counter() - start
+    await ingest_queue.join()
+    return accepted, time.perf_counter() - start
+
+
+async def check_order(client: httpx.AsyncClient, events: list) -> list:
+    """Incidents whose write-behind events don't come back in posting order"""
+    expected = {}
+    for event in events:
+        expected.setdefault(event["incident_id"], []).append(event["description"])
+    out_of_order = []
+    for incident_id, descriptions in expected.items():
+        response = await client.get(f"/api/timeline/{incident_id}")
+        response.raise_for_status()
+        posted = set(descriptions)
+        returned = [event["description"] for event in response.json()["data"] if event["description"] in posted]
+        if returned != descriptions:
+            out_of_order.append(incident_id)
+    return out_of_order
+
+
+async def bulk(client: httpx.AsyncClient, events: list, batch: int) -> float:
+    start = time.perf_counter()
+    for offset in range(0, len(events), batch):
+        response = await client.post("/api/timeline/bulk", json=events[offset:offset + batch])
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(count: int, incidents: int, batch: int, concurrency: int):
+    async with app_client() as client:
+        incident_ids = []
+        for i in range(incidents):
+            created = await client.post("/api/incidents/", json={
+                "title": f"Ingest benchmark {i}",
+                "description": "Seeded by benchmarks.timeline_ingest"
+            })
+            incident_ids.append(created.json()["data"]["id"])
+
+        events = make_events(incident_ids, count)
+        single_elapsed = await single(client, events, concurrency)
+        queued = [{**event, "description": f"Queued {event['description']}"} for event in events]
+        accepted_elapsed, written_elapsed = await write_behind(client, queued, concurrency)
+        out_of_order = await check_order(client, queued)
+        bulk_elapsed = await bulk(client, events, batch)
+
+        for incident_id in incident_ids:
+            await client.delete(f"/api/incidents/{incident_id}")
+
+    print(f"single: {count / single_elapsed:.0f} events/s ({single_elapsed:.2f}s, concurrency={concurrency})")
+    print(f"async:  {count / accepted_elapsed:.0f} events/s accepted ({accepted_elapsed:.2f}s), "
+          f"all written after {written_elapsed:.2f}s, queue stats {ingest_queue.stats()}")
+    print(f"bulk:   {count / bulk_elapsed:.0f} events/s ({bulk_elapsed:.2f}s, batch={batch})")
+    if out_of_order:
+        raise SystemExit(f"Write-behind events out of order for incidents: {', '.join(out_of_order)}")
+    print("async:  per-incident order preserved")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--incidents", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.events, args.incidents, args.batch, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
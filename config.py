@@ -1,28 +1,162 @@
-
-from pymongo.mongo_client import MongoClient
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.monitoring import ConnectionPoolListener
 from pymongo.server_api import ServerApi
 import certifi
+import json
 import os
 from dotenv import load_dotenv
+from middleware.metrics import CommandMetrics
 
 # Load environment variables from .env file
 load_dotenv()
 
 uri = os.getenv("MONGODB_URI")
 
-# Create a new client and connect to the server with proper SSL configuration
-client = MongoClient(
-    uri, 
-    server_api=ServerApi('1'),
-    tlsCAFile=certifi.where(),
-    connectTimeoutMS=30000,
-    socketTimeoutMS=30000,
-    serverSelectionTimeoutMS=30000
-)
-
-db = client.incident_db
-
-# Collections
-incidents_collection = db["incidents"]
-timeline_collection = db["timeline_events"]
-postmortem_collection = db["postmortems"]
+# Set MONGODB_TLS=false for a local mongod without TLS, e.g. when benchmarking
+MONGODB_TLS = os.getenv("MONGODB_TLS", "true").lower() == "true"
+
+# Connection pool and timeout settings
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "5"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "30000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+# Read cache settings; set CACHE_REDIS_URL to share the cache between workers
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+# Request instrumentation: add a Server-Timing header to responses, and log
+# requests slower than the threshold
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() == "true"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+# Source of live timeline changes: "local" write paths of this worker, or
+# "change_stream" to see writes from every worker (requires a replica set)
+TIMELINE_STREAM_SOURCE = os.getenv("TIMELINE_STREAM_SOURCE", "local")
+
+# Incident deletion and archival: timelines up to CASCADE_SYNC_LIMIT events are
+# deleted within the request, longer ones by a background job. File archives
+# are written as gzipped JSONL to ARCHIVE_DIR.
+CASCADE_SYNC_LIMIT = int(os.getenv("CASCADE_SYNC_LIMIT", "1000"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Write-behind timeline ingestion (POST /api/timeline/?async=true): queue
+# capacity, and the batch size and interval at which queued events are written
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL_MS = float(os.getenv("INGEST_FLUSH_INTERVAL_MS", "100"))
+
+# Token-bucket rate limiting per client and route: RATE_LIMIT_RATE requests per
+# second with bursts of RATE_LIMIT_BURST. RATE_LIMIT_ROUTES overrides them per
+# route template as JSON, e.g. {"/api/search": [2, 10]}. Set RATE_LIMIT_REDIS_URL
+# to share the limits between workers, and trust X-Forwarded-For only behind a proxy.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_ROUTES = {route: tuple(limit) for route, limit in json.loads(os.getenv("RATE_LIMIT_ROUTES", "{}")).items()}
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+class PoolStats(ConnectionPoolListener):
+    """Counts connection pool activity for the readiness endpoint"""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.check_out_failures = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+        self.created += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures += 1
+
+    def stats(self) -> dict:
+        return {
+            "open_connections": self.open,
+            "checked_out": self.checked_out,
+            "connections_created": self.created,
+            "check_out_failures": self.check_out_failures,
+            "max_pool_size": MONGODB_MAX_POOL_SIZE,
+            "min_pool_size": MONGODB_MIN_POOL_SIZE
+        }
+
+# The client and collections are created by connect(), called from the app
+# lifespan. That runs in each worker process after the server forks, so no
+# connection pool is ever shared between processes. Modules read them as
+# config.<name> at call time rather than importing them.
+client = None
+db = None
+incidents_collection = None
+timeline_collection = None
+postmortem_collection = None
+jobs_collection = None
+revisions_collection = None
+pool_stats = PoolStats()
+command_metrics = CommandMetrics()
+
+def connect():
+    """Create this worker's async client with proper SSL configuration"""
+    global client, db, incidents_collection, timeline_collection, postmortem_collection, jobs_collection
+    global revisions_collection
+    tls_options = {"tlsCAFile": certifi.where()} if MONGODB_TLS else {}
+    client = AsyncMongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        **tls_options,
+        maxPoolSize=MONGODB_MAX_POOL_SIZE,
+        minPoolSize=MONGODB_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_stats, command_metrics]
+    )
+    db = client.incident_db
+
+    # Collections
+    incidents_collection = db["incidents"]
+    timeline_collection = db["timeline_events"]
+    postmortem_collection = db["postmortems"]
+    jobs_collection = db["jobs"]
+    revisions_collection = db["postmortem_revisions"]
+
+async def close():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
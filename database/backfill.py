@@ -0,0 +1,35 @@
+import asyncio
+import config
+from database import repository
+
+# Rebuilds the denormalized summary of every incident from its timeline and
+# postmortem. Run it once after deploying summaries, or whenever they may have
+# drifted: python -m database.backfill
+BATCH_SIZE = 500
+
+async def backfill_summaries(batch_size: int = BATCH_SIZE) -> int:
+    """Recompute the summary of every incident, a batch of IDs at a time, and return how many were updated"""
+    processed = 0
+    last_id = None
+    while True:
+        # Walk the _id index so each batch is a cheap range scan
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        cursor = config.incidents_collection.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)
+        incident_ids = [incident["_id"] async for incident in cursor]
+        if not incident_ids:
+            return processed
+        await repository.refresh_incident_summaries(*(str(incident_id) for incident_id in incident_ids))
+        processed += len(incident_ids)
+        last_id = incident_ids[-1]
+        print(f"Backfilled {processed} incident summaries", flush=True)
+
+async def _main():
+    config.connect()
+    try:
+        processed = await backfill_summaries()
+    finally:
+        await config.close()
+    print(f"Done: {processed} incidents")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,173 @@
+import time
+from collections import OrderedDict
+import bson
+from config import CACHE_MAX_SIZE, CACHE_TTL_SECONDS, CACHE_REDIS_URL
+
+# Read caches for documents that are read far more often than they change. The
+# repository consults them on lookups and invalidates or refreshes them on
+# writes. Both backends share the same async interface so they can be swapped
+# through configuration.
+#
+# A read that queried the database before a write can finish after it. Writes
+# go through set() and delete(), which tick the cache's write clock; reads fill
+# the cache through fill(), which does nothing if the key was written since the
+# read noted the clock, so a slow read can't put back the document a write
+# just replaced.
+
+WRITE_CLOCK_KEYS = 10000
+
+class WriteClock:
+    """Remembers when each key was last written, for the most recent keys
+
+    A key that has been forgotten counts as written at the latest tick
+    forgotten, which can only make a fill be skipped, never a stale one kept.
+    """
+
+    def __init__(self, max_keys: int = WRITE_CLOCK_KEYS):
+        self.max_keys = max_keys
+        self.tick = 0
+        self._floor = 0
+        self._written = OrderedDict()
+
+    def written(self, key: str):
+        self.tick += 1
+        self._written[key] = self.tick
+        self._written.move_to_end(key)
+        while len(self._written) > self.max_keys:
+            self._floor = self._written.popitem(last=False)[1]
+
+    def written_all(self):
+        self.tick += 1
+        self._floor = self.tick
+        self._written.clear()
+
+    def written_since(self, key: str, tick: int) -> bool:
+        return self._written.get(key, self._floor) > tick
+
+class LocalCache:
+    """Bounded in-process cache with LRU eviction and a per-entry TTL"""
+
+    def __init__(self, name: str, max_size: int = 1024, ttl: float = 30.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clock = WriteClock()
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, document = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Hand out copies so callers can't mutate the cached document
+        return dict(document)
+
+    async def set(self, key: str, document: dict):
+        self.clock.written(key)
+        self._store(key, document)
+
+    async def fill(self, key: str, document: dict, since: int):
+        """Cache a document read from the database, unless the key was written after tick since"""
+        if not self.clock.written_since(key, since):
+            self._store(key, document)
+
+    def _store(self, key: str, document: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, dict(document))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self.clock.written(key)
+        self._entries.pop(key, None)
+
+    async def clear(self):
+        self.clock.written_all()
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class RedisCache:
+    """Cache shared by all workers, stored in Redis as BSON with a TTL
+
+    Requires the optional redis package. Redis evicts expired entries itself, so
+    only hits and misses are counted here. The write clock only sees this
+    worker's writes.
+    """
+
+    def __init__(self, name: str, url: str, ttl: float = 30.0):
+        import redis.asyncio as redis
+
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.clock = WriteClock()
+        self._redis = redis.Redis.from_url(url)
+
+    def _key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def get(self, key: str):
+        data = await self._redis.get(self._key(key))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bson.decode(data)
+
+    async def set(self, key: str, document: dict):
+        self.clock.written(key)
+        await self._redis.set(self._key(key), bson.encode(document), px=int(self.ttl * 1000))
+
+    async def fill(self, key: str, document: dict, since: int):
+        """Cache a document read from the database, unless the key was written after tick since"""
+        if not self.clock.written_since(key, since):
+            await self._redis.set(self._key(key), bson.encode(document), px=int(self.ttl * 1000))
+
+    async def delete(self, key: str):
+        self.clock.written(key)
+        await self._redis.delete(self._key(key))
+
+    async def clear(self):
+        self.clock.written_all()
+        async for key in self._redis.scan_iter(match=self._key("*")):
+            await self._redis.delete(key)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+def create_cache(name: str, max_size: int, ttl: float, redis_url: str = None):
+    """Build a shared Redis cache when a URL is configured, otherwise a local one"""
+    if redis_url:
+        return RedisCache(name, redis_url, ttl)
+    return LocalCache(name, max_size, ttl)
+
+incident_cache = create_cache("incidents", CACHE_MAX_SIZE, CACHE_TTL_SECONDS, CACHE_REDIS_URL)
+postmortem_cache = create_cache("postmortems", CACHE_MAX_SIZE, CACHE_TTL_SECONDS, CACHE_REDIS_URL)
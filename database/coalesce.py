@@ -0,0 +1,59 @@
+import asyncio
+
+# Single-flight coalescing for hot reads. During a major incident many clients
+# ask for the same document at the same moment; the first caller's query is
+# shared with everyone who asks for the same key while it is in flight, so the
+# database sees one query instead of hundreds. Nothing is kept once the query
+# finishes, so this never serves data older than a fresh query would.
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its result with concurrent callers"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.enabled = True
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+
+    async def do(self, key, load):
+        """Return load()'s result, joining an identical call that is already running"""
+        if not self.enabled:
+            return await load()
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            # A task, so one caller disconnecting doesn't cancel the query for the rest
+            task = self._in_flight[key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        result = await asyncio.shield(task)
+        # Callers share the result, so each gets its own top-level copy
+        if isinstance(result, dict):
+            return dict(result)
+        if isinstance(result, list):
+            return list(result)
+        return result
+
+    def forget(self, *keys):
+        """Make later callers start a fresh call, e.g. after a write changed the result"""
+        for key in keys:
+            self._in_flight.pop(key, None)
+
+    def _finished(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark a failure as retrieved when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "queries": self.calls,
+            "coalesced": self.shared
+        }
+
+reads = SingleFlight("reads")
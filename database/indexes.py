@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, monitoring
+from pymongo.errors import OperationFailure
+import config
+
+logger = logging.getLogger(__name__)
+
+# Indexes matching the query shapes used by the services. create_indexes is a
+# no-op for indexes that already exist, so this is safe to run on every startup.
+INDEXES = [
+    ("incidents", [
+        # Unfiltered listing, keyset-paginated on (created_at, _id)
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+        # Listing filtered by status and/or severity
+        IndexModel(
+            [("status", ASCENDING), ("severity", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="status_severity_created_at"
+        ),
+        # Closed incidents due for archival
+        IndexModel([("status", ASCENDING), ("resolved_at", ASCENDING)], name="status_resolved_at"),
+        # Full-text search
+        IndexModel([("title", TEXT), ("description", TEXT)], name="text", weights={"title": 10, "description": 5}),
+    ]),
+    ("timeline_events", [
+        # Timeline for an incident in chronological order, resumable from a (timestamp, _id) key
+        IndexModel(
+            [("incident_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+            name="incident_id_timestamp_id"
+        ),
+        # Full-text search
+        IndexModel([("description", TEXT)], name="text"),
+    ]),
+    ("postmortems", [
+        # One postmortem per incident
+        IndexModel([("incident_id", ASCENDING)], name="incident_id_unique", unique=True),
+        # Full-text search
+        IndexModel(
+            [("root_cause", TEXT), ("contributing_factors", TEXT)],
+            name="text",
+            weights={"root_cause": 3, "contributing_factors": 2}
+        ),
+    ]),
+    ("postmortem_revisions", [
+        # Append-only history; a revision is rebuilt from a range of revision numbers
+        IndexModel([("incident_id", ASCENDING), ("revision", ASCENDING)], name="incident_id_revision", unique=True),
+    ]),
+    ("jobs", [
+        # Unfinished jobs to resume on startup
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ]),
+]
+
+async def ensure_indexes():
+    """Create any missing indexes on all collections"""
+    for name, indexes in INDEXES:
+        try:
+            await config.db[name].create_indexes(indexes)
+        except OperationFailure as e:
+            # Typically duplicate data blocking a unique index; keep serving and report it
+            logger.error("Could not create indexes on %s: %s", name, e)
+
+# Query plan verification
+# Rather than keeping a copy of the service queries that could drift from the
+# code, the check calls the repository's read functions with sample arguments,
+# records the commands they send, and explains each of them. Writes select by
+# _id or go through the same filters as these reads. Analytics over an open
+# date range scan every incident by design, so they are checked with a range.
+EXPLAINED_COMMANDS = ("find", "aggregate", "count", "distinct")
+# Session, transaction and server API fields the driver adds, which explain rejects
+DRIVER_FIELDS = (
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "readConcern",
+    "apiVersion", "apiStrict", "apiDeprecationErrors"
+)
+
+class QueryRecorder(monitoring.CommandListener):
+    """Collects the read commands sent while a labelled repository call runs"""
+
+    def __init__(self):
+        self.label = None
+        self.commands = []
+
+    def started(self, event):
+        if self.label and event.command_name in EXPLAINED_COMMANDS:
+            command = {key: value for key, value in event.command.items() if key not in DRIVER_FIELDS}
+            self.commands.append((self.label, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+recorder = QueryRecorder()
+
+def _repository_reads():
+    """(label, call) for every repository function that queries, with arguments that match nothing"""
+    from database import repository
+    from database.models import EventType
+
+    sample_id = str(ObjectId())
+    now = datetime.now()
+    week_ago = now - timedelta(days=7)
+    after = (now, ObjectId())
+
+    async def consume(generator):
+        async for _ in generator:
+            pass
+
+    return [
+        ("find_incident", lambda: repository.find_incident(sample_id)),
+        ("find_incidents", lambda: repository.find_incidents({}, None, 50)),
+        ("find_incidents after", lambda: repository.find_incidents({}, after, 50)),
+        ("find_incidents status", lambda: repository.find_incidents({"status": "Open"}, None, 50)),
+        ("find_incidents status severity", lambda: repository.find_incidents({"status": "Open", "severity": "High"}, after, 50)),
+        ("count_incidents status", lambda: repository.count_incidents({"status": "Open"})),
+        ("find_incidents_by_ids", lambda: repository.find_incidents_by_ids([sample_id])),
+        ("find_existing_incident_ids", lambda: repository.find_existing_incident_ids([sample_id])),
+        ("refresh_incident_summaries", lambda: repository.refresh_incident_summaries(sample_id)),
+        ("compute_incident_summaries", lambda: repository.compute_incident_summaries([sample_id])),
+        ("find_timeline", lambda: repository.find_timeline(sample_id)),
+        ("find_timeline after", lambda: repository.find_timeline(sample_id, after)),
+        ("find_timeline_bounds", lambda: repository.find_timeline_bounds(sample_id)),
+        ("summarize_timeline", lambda: repository.summarize_timeline(sample_id, "minute", 5, [EventType.DETECTION.value], 3, 500, 1000)),
+        ("find_timeline_event_key", lambda: repository.find_timeline_event_key(sample_id, str(ObjectId()))),
+        ("find_timeline_version", lambda: repository.find_timeline_version(sample_id)),
+        ("count_timeline_events", lambda: repository.count_timeline_events(sample_id, 1000)),
+        ("delete_timeline_batch", lambda: repository.delete_timeline_batch(sample_id, 1000)),
+        ("iter_timeline_batches", lambda: consume(repository.iter_timeline_batches(sample_id, 1000))),
+        ("find_postmortem", lambda: repository.find_postmortem(sample_id)),
+        ("find_postmortem_revisions", lambda: repository.find_postmortem_revisions(sample_id)),
+        ("find_revision_chain", lambda: repository.find_revision_chain(sample_id, 12)),
+        ("find_report", lambda: repository.find_report(sample_id, 100)),
+        ("iter_reports", lambda: consume(repository.iter_reports(week_ago, now))),
+        ("count_incidents_by_bucket", lambda: repository.count_incidents_by_bucket("day", "severity", week_ago, now)),
+        ("resolution_times", lambda: repository.resolution_times("severity", week_ago, now)),
+        ("response_times", lambda: repository.response_times("severity", week_ago, now)),
+        ("search_incidents", lambda: repository.search_incidents("timeout", 200)),
+        ("search_timeline", lambda: repository.search_timeline("timeout", 200)),
+        ("search_postmortems", lambda: repository.search_postmortems("timeout", 200)),
+        ("find_archivable_incidents", lambda: repository.find_archivable_incidents(now - timedelta(days=90), 100)),
+        ("find_job", lambda: repository.find_job(str(ObjectId()))),
+        ("find_jobs", lambda: repository.find_jobs()),
+        ("find_jobs status", lambda: repository.find_jobs("running")),
+        ("find_resumable_job_ids", lambda: repository.find_resumable_job_ids(now)),
+    ]
+
+def _winning_plans(explanation) -> list:
+    """Every winningPlan in an explain result, including those of aggregation stages and shards"""
+    if isinstance(explanation, dict):
+        plans = [explanation["winningPlan"]] if "winningPlan" in explanation else []
+        for key, value in explanation.items():
+            if key not in ("winningPlan", "rejectedPlans"):
+                plans += _winning_plans(value)
+        return plans
+    if isinstance(explanation, list):
+        return [plan for value in explanation for plan in _winning_plans(value)]
+    return []
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(value) for value in plan)
+    return False
+
+async def verify_query_plans() -> list:
+    """Explain every query the repository's reads send and return those that still scan a collection
+
+    The recorder must be registered before the client is created.
+    """
+    recorder.commands = []
+    for label, call in _repository_reads():
+        recorder.label = label
+        try:
+            await call()
+        finally:
+            recorder.label = None
+    failures = []
+    for label, command in recorder.commands:
+        explanation = await config.db.command({"explain": command, "verbosity": "queryPlanner"})
+        if any(_has_collscan(plan) for plan in _winning_plans(explanation)):
+            collection = next(iter(command.values()))
+            failures.append({"function": label, "collection": collection, "command": command})
+    return failures
+
+async def _main():
+    monitoring.register(recorder)
+    config.connect()
+    try:
+        await ensure_indexes()
+        failures = await verify_query_plans()
+    finally:
+        await config.close()
+    for failure in failures:
+        print(f"COLLSCAN: {failure['function']} on {failure['collection']}: {failure['command']}")
+    if failures:
+        sys.exit(1)
+    print("All service queries use an index")
+
+if __name__ == "__main__":
+    # python -m database.indexes creates the indexes and fails if any query is a COLLSCAN
+    asyncio.run(_main())
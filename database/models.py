@@ -35,6 +35,27 @@ class Incident(BaseModel):
     class Config:
         use_enum_values = True
 
+# Partial incident update: only the fields a client sends are written
+class IncidentUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    severity: Optional[SeverityLevel] = None
+    status: Optional[IncidentStatus] = None
+    resolved_at: Optional[datetime] = None
+    # Version the client last read, to reject the update if someone changed it since
+    version: Optional[int] = None
+
+    class Config:
+        use_enum_values = True
+
+# Status transition applied to several incidents at once
+class IncidentStatusUpdate(BaseModel):
+    ids: List[str]
+    status: IncidentStatus
+
+    class Config:
+        use_enum_values = True
+
 # Timeline Event Model
 class TimelineEvent(BaseModel):
     incident_id: str
@@ -55,3 +76,15 @@ class Postmortem(BaseModel):
     action_items: List[str] = []
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+
+# Partial timeline event update: only the fields a client sends are written
+class TimelineEventUpdate(BaseModel):
+    event_type: Optional[EventType] = None
+    description: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    created_by: Optional[str] = None
+    # Version the client last read, to reject the update if someone changed it since
+    version: Optional[int] = None
+
+    class Config:
+        use_enum_values = True
@@ -0,0 +1,921 @@
+import asyncio
+import logging
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from datetime import datetime
+from typing import Optional
+import config
+from database.cache import incident_cache, postmortem_cache
+from database.coalesce import reads
+from database.models import EventType, IncidentStatus
+from database.revisions import revision_document, snapshot_revision
+from database.schemas import INCIDENT_PROJECTION, TIMELINE_EVENT_PROJECTION, TIMELINE_EVENT_SUMMARY_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+# All database access for the routers goes through this module. The collections
+# come from the async PyMongo client, so every call here is awaited and yields
+# the event loop instead of blocking the worker while Mongo responds.
+
+# Concurrent identical reads of the same incident share one query through
+# reads (see database.coalesce); writes call _forget_reads so that nobody joins
+# a query that started before the write.
+def _forget_reads(*incident_ids: str):
+    for incident_id in incident_ids:
+        incident_id = str(incident_id)
+        reads.forget(
+            ("incident", incident_id), ("timeline", incident_id),
+            ("timeline_version", incident_id), ("postmortem", incident_id)
+        )
+
+# Timeline writes forget coalesced timeline reads as soon as the write returns,
+# before the incident's timeline_version is bumped. Otherwise a reader could see
+# the new version, join a read that started before the write, and store the old
+# events under the new ETag.
+def _forget_timeline(*incident_ids):
+    reads.forget(*(("timeline", str(incident_id)) for incident_id in incident_ids if incident_id))
+
+# Multi-document transactions need a replica set or sharded cluster; a
+# standalone mongod, e.g. for local benchmarks, has none
+_transactions_supported = None
+
+async def transactions_supported() -> bool:
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await config.client.admin.command("hello")
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+# Incident queries
+async def find_incident(incident_id: str):
+    """Fetch an incident, served from the read cache when possible"""
+    incident = await incident_cache.get(str(incident_id))
+    if incident is None:
+        incident = await reads.do(("incident", str(incident_id)), lambda: _load_incident(incident_id))
+    return incident
+
+async def _load_incident(incident_id: str):
+    since = incident_cache.clock.tick
+    incident = await config.incidents_collection.find_one({"_id": ObjectId(incident_id)})
+    if incident:
+        await incident_cache.fill(str(incident_id), incident, since)
+    return incident
+
+def iter_incidents(query: dict, after: Optional[tuple] = None, limit: Optional[int] = None):
+    """Return a cursor over incidents, newest first, keyset-paginated on (created_at, _id)"""
+    if after:
+        created_at, object_id = after
+        if created_at is None:
+            # Incidents without created_at sort last, so only they can follow
+            keyset = {"created_at": None, "_id": {"$lt": object_id}}
+        else:
+            keyset = {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": object_id}},
+                {"created_at": None}
+            ]}
+        query = {"$and": [query, keyset]}
+    cursor = config.incidents_collection.find(query, INCIDENT_PROJECTION).sort([("created_at", -1), ("_id", -1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+async def find_incidents(query: dict, after: Optional[tuple] = None, limit: Optional[int] = None) -> list:
+    return await iter_incidents(query, after, limit).to_list(None)
+
+async def count_incidents(query: dict, estimated: bool = False) -> int:
+    # The collection metadata count is only valid for an unfiltered query
+    if estimated and not query:
+        return await config.incidents_collection.estimated_document_count()
+    return await config.incidents_collection.count_documents(query)
+
+async def insert_incident(incident_dict: dict):
+    return await config.incidents_collection.insert_one(incident_dict)
+
+async def insert_incidents(incidents: list) -> dict:
+    """Insert incidents unordered and return {index: error message} for any that failed"""
+    try:
+        await config.incidents_collection.insert_many(incidents, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+    return {}
+
+async def update_incident(incident_id: str, update, condition: Optional[dict] = None):
+    """Apply an update and return the updated incident, or None if it doesn't exist or fails the condition"""
+    incident = await config.incidents_collection.find_one_and_update(
+        {"_id": ObjectId(incident_id), **(condition or {})},
+        update,
+        return_document=ReturnDocument.AFTER
+    )
+    _forget_reads(incident_id)
+    # Write-through so the next read sees the new version without a query
+    if incident:
+        await incident_cache.set(str(incident_id), incident)
+    else:
+        await incident_cache.delete(str(incident_id))
+    return incident
+
+async def update_incidents(incident_ids: list, update):
+    """Apply the same update to several incidents in one bulk write and return the number matched"""
+    result = await config.incidents_collection.bulk_write([
+        UpdateOne({"_id": ObjectId(incident_id)}, update) for incident_id in incident_ids
+    ], ordered=False)
+    _forget_reads(*incident_ids)
+    for incident_id in incident_ids:
+        await incident_cache.delete(incident_id)
+    return result.matched_count
+
+async def delete_incident(incident_id: str, cascade_timeline: bool = True) -> Optional[dict]:
+    """Delete an incident with its postmortem, and its timeline unless told not to, in one transaction
+    
+    Returns the number of documents removed per collection, or None if the
+    incident doesn't exist, in which case nothing is deleted. Without
+    transactions the children are deleted first and the incident last, so an
+    interrupted delete leaves the incident in place to be deleted again rather
+    than children without their incident.
+    """
+    async def delete_children(session=None) -> dict:
+        postmortems = await config.postmortem_collection.delete_many({"incident_id": incident_id}, session=session)
+        await config.revisions_collection.delete_many({"incident_id": incident_id}, session=session)
+        deleted = {"incidents": 1, "postmortems": postmortems.deleted_count, "timeline_events": 0}
+        if cascade_timeline:
+            events = await config.timeline_collection.delete_many({"incident_id": incident_id}, session=session)
+            deleted["timeline_events"] = events.deleted_count
+        return deleted
+    
+    async def delete_all(session):
+        result = await config.incidents_collection.delete_one({"_id": ObjectId(incident_id)}, session=session)
+        if result.deleted_count == 0:
+            return None
+        return await delete_children(session)
+    
+    if await transactions_supported():
+        async with config.client.start_session() as session:
+            deleted = await session.with_transaction(delete_all)
+    elif await config.incidents_collection.find_one({"_id": ObjectId(incident_id)}, {"_id": 1}) is None:
+        deleted = None
+    else:
+        deleted = await delete_children()
+        await config.incidents_collection.delete_one({"_id": ObjectId(incident_id)})
+    _forget_reads(incident_id)
+    await incident_cache.delete(str(incident_id))
+    await postmortem_cache.delete(str(incident_id))
+    return deleted
+
+async def find_incidents_by_ids(incident_ids: list) -> list:
+    """Fetch several incidents with a single $in query"""
+    cursor = config.incidents_collection.find(
+        {"_id": {"$in": [ObjectId(incident_id) for incident_id in incident_ids]}},
+        INCIDENT_PROJECTION
+    )
+    return await cursor.to_list(None)
+
+async def find_existing_incident_ids(incident_ids: list) -> set:
+    """Return which of the given incident IDs exist, using a single $in query"""
+    cursor = config.incidents_collection.find(
+        {"_id": {"$in": [ObjectId(incident_id) for incident_id in incident_ids]}},
+        {"_id": 1}
+    )
+    return {str(incident["_id"]) async for incident in cursor}
+
+async def incident_exists(incident_id: str) -> bool:
+    """Whether an incident exists, checked in the database before writing documents that belong to it
+    
+    The read cache may still hold an incident another worker deleted.
+    """
+    return bool(await find_existing_incident_ids([incident_id]))
+
+# Incident summaries
+# Each incident carries a summary of its timeline and postmortem, so listings
+# can show them without further queries. Inserts fold new events in with a
+# single atomic update; edits and deletes, which can change any field, rebuild
+# it from the timeline instead. summary.updated_at records when any of it last
+# changed, since that doesn't touch the incident's own updated_at.
+EMPTY_SUMMARY = {
+    "event_count": 0,
+    "last_event_at": None,
+    "last_event_type": None,
+    "first_detection_at": None,
+    "first_mitigation_at": None,
+    "has_postmortem": False,
+    "updated_at": None
+}
+TIMELINE_SUMMARY_FIELDS = ("event_count", "last_event_at", "last_event_type", "first_detection_at", "first_mitigation_at")
+SUMMARY_REFRESH_ATTEMPTS = 5
+FIRST_EVENT_FIELDS = {
+    EventType.DETECTION.value: "first_detection_at",
+    EventType.MITIGATION.value: "first_mitigation_at"
+}
+
+def timeline_insert_update(events: list) -> list:
+    """Update pipeline bumping the timeline version and folding new events into the summary"""
+    latest = max(events, key=lambda event: event["timestamp"])
+    stage = {
+        "timeline_version": {"$add": [{"$ifNull": ["$timeline_version", 0]}, 1]},
+        "summary.event_count": {"$add": [{"$ifNull": ["$summary.event_count", 0]}, len(events)]},
+        # Every expression sees the document as it was before the stage, so this
+        # compares against the previous last_event_at
+        "summary.last_event_type": {"$cond": [
+            {"$gte": [latest["timestamp"], {"$ifNull": ["$summary.last_event_at", latest["timestamp"]]}]},
+            {"$literal": latest["event_type"]},
+            "$summary.last_event_type"
+        ]},
+        "summary.last_event_at": {"$max": ["$summary.last_event_at", latest["timestamp"]]},
+        "summary.updated_at": {"$literal": datetime.now()}
+    }
+    for event_type, field in FIRST_EVENT_FIELDS.items():
+        timestamps = [event["timestamp"] for event in events if event["event_type"] == event_type]
+        if timestamps:
+            stage[f"summary.{field}"] = {"$min": [f"$summary.{field}", min(timestamps)]}
+    return [{"$set": stage}]
+
+async def record_timeline_inserts(events: list):
+    """Apply timeline_insert_update to every incident the new events belong to"""
+    by_incident = {}
+    for event in events:
+        by_incident.setdefault(event["incident_id"], []).append(event)
+    if len(by_incident) == 1:
+        # The common single-incident case writes through to the cache
+        incident_id, incident_events = next(iter(by_incident.items()))
+        await update_incident(incident_id, timeline_insert_update(incident_events))
+        return
+    await config.incidents_collection.bulk_write([
+        UpdateOne({"_id": ObjectId(incident_id)}, timeline_insert_update(incident_events))
+        for incident_id, incident_events in by_incident.items()
+    ], ordered=False)
+    _forget_reads(*by_incident)
+    for incident_id in by_incident:
+        await incident_cache.delete(incident_id)
+
+async def compute_incident_summaries(incident_ids: list) -> dict:
+    """Build the summaries of several incidents from their timelines and postmortems"""
+    pipeline = [
+        {"$match": {"incident_id": {"$in": incident_ids}}},
+        {"$sort": {"incident_id": 1, "timestamp": 1, "_id": 1}},
+        {"$group": {
+            "_id": "$incident_id",
+            "event_count": {"$sum": 1},
+            "last_event_at": {"$last": "$timestamp"},
+            "last_event_type": {"$last": "$event_type"},
+            # $min skips the nulls left by events of other types
+            **{
+                field: {"$min": {"$cond": [{"$eq": ["$event_type", event_type]}, "$timestamp", None]}}
+                for event_type, field in FIRST_EVENT_FIELDS.items()
+            }
+        }}
+    ]
+    summaries = {incident_id: dict(EMPTY_SUMMARY) for incident_id in incident_ids}
+    async for row in await config.timeline_collection.aggregate(pipeline):
+        summaries[row.pop("_id")].update(row)
+    cursor = config.postmortem_collection.find({"incident_id": {"$in": incident_ids}}, {"incident_id": 1})
+    async for postmortem in cursor:
+        summaries[postmortem["incident_id"]]["has_postmortem"] = True
+    return summaries
+
+async def refresh_incident_summaries(*incident_ids: str, bump_version: bool = False):
+    """Recompute and store the summaries of these incidents, optionally marking their timelines changed
+    
+    Every timeline insert bumps the incident's timeline_version, so a summary
+    is only stored if the version is still the one read before computing it;
+    otherwise an insert landed in between and the summary is computed again.
+    has_postmortem is only ever set, as postmortems are not deleted on their own.
+    """
+    pending = [str(incident_id) for incident_id in incident_ids]
+    for _ in range(SUMMARY_REFRESH_ATTEMPTS):
+        cursor = config.incidents_collection.find(
+            {"_id": {"$in": [ObjectId(incident_id) for incident_id in pending]}},
+            {"timeline_version": 1}
+        )
+        versions = {str(incident["_id"]): incident.get("timeline_version") async for incident in cursor}
+        summaries = await compute_incident_summaries(list(versions))
+        now = datetime.now()
+        pending = []
+        for incident_id, summary in summaries.items():
+            fields = {f"summary.{field}": summary[field] for field in TIMELINE_SUMMARY_FIELDS}
+            if summary["has_postmortem"]:
+                fields["summary.has_postmortem"] = True
+            fields["summary.updated_at"] = now
+            increment = {"$inc": {"timeline_version": 1}} if bump_version else {}
+            # A null version also matches incidents written before it existed
+            result = await config.incidents_collection.update_one(
+                {"_id": ObjectId(incident_id), "timeline_version": versions[incident_id]},
+                {"$set": fields, **increment}
+            )
+            if result.matched_count == 0:
+                pending.append(incident_id)
+        _forget_reads(*summaries)
+        for incident_id in summaries:
+            await incident_cache.delete(incident_id)
+        if not pending:
+            return
+    logger.warning("Gave up refreshing summaries of incidents %s under concurrent timeline writes", pending)
+
+async def mark_has_postmortem(incident_id: str):
+    await update_incident(incident_id, {"$set": {"summary.has_postmortem": True, "summary.updated_at": datetime.now()}})
+
+# Timeline queries
+async def find_timeline(incident_id: str, after: Optional[tuple] = None) -> list:
+    """Fetch an incident's events in order, optionally only those after a (timestamp, _id) key"""
+    if after is None:
+        # Full timelines are what a crowd opening the same incident asks for
+        return await reads.do(("timeline", incident_id), lambda: _load_timeline(incident_id, None))
+    return await _load_timeline(incident_id, after)
+
+async def _load_timeline(incident_id: str, after: Optional[tuple]) -> list:
+    query = {"incident_id": incident_id}
+    if after:
+        timestamp, object_id = after
+        if object_id:
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": object_id}}
+            ]
+        else:
+            query["timestamp"] = {"$gt": timestamp}
+    cursor = config.timeline_collection.find(query, TIMELINE_EVENT_PROJECTION).sort([("timestamp", 1), ("_id", 1)])
+    return await cursor.to_list(None)
+
+async def find_timeline_bounds(incident_id: str) -> Optional[tuple]:
+    """Timestamps of an incident's first and last events, from two index lookups"""
+    first = await config.timeline_collection.find_one(
+        {"incident_id": incident_id}, {"timestamp": 1}, sort=[("timestamp", 1), ("_id", 1)]
+    )
+    if not first:
+        return None
+    last = await config.timeline_collection.find_one(
+        {"incident_id": incident_id}, {"timestamp": 1}, sort=[("timestamp", -1), ("_id", -1)]
+    )
+    return first["timestamp"], last["timestamp"]
+
+async def summarize_timeline(
+    incident_id: str,
+    unit: str,
+    bin_size: int,
+    key_event_types: list,
+    samples: int,
+    max_buckets: int,
+    max_key_events: int
+) -> dict:
+    """Downsample an incident's timeline into time buckets in a single aggregation
+    
+    Events of key_event_types are returned whole. All others are counted per
+    bucket and event type, keeping the first few descriptions of each as samples.
+    """
+    pipeline = [
+        {"$match": {"incident_id": incident_id}},
+        # Served by the (incident_id, timestamp, _id) index; keeps samples and key events chronological
+        {"$sort": {"timestamp": 1, "_id": 1}},
+        {"$facet": {
+            "buckets": [
+                {"$match": {"event_type": {"$nin": key_event_types}}},
+                {"$group": {
+                    "_id": {
+                        "start": {"$dateTrunc": {"date": "$timestamp", "unit": unit, "binSize": bin_size}},
+                        "event_type": "$event_type"
+                    },
+                    "count": {"$sum": 1},
+                    "samples": {"$firstN": {"input": "$description", "n": samples}}
+                }},
+                {"$group": {
+                    "_id": "$_id.start",
+                    "count": {"$sum": "$count"},
+                    "counts": {"$push": {"k": "$_id.event_type", "v": "$count"}},
+                    "samples": {"$push": {"k": "$_id.event_type", "v": "$samples"}}
+                }},
+                {"$sort": {"_id": 1}},
+                {"$limit": max_buckets},
+                {"$project": {
+                    "_id": 0,
+                    "start": "$_id",
+                    "count": 1,
+                    "counts": {"$arrayToObject": "$counts"},
+                    "samples": {"$arrayToObject": "$samples"}
+                }}
+            ],
+            "key_events": [
+                {"$match": {"event_type": {"$in": key_event_types}}},
+                {"$limit": max_key_events},
+                {"$project": TIMELINE_EVENT_PROJECTION}
+            ],
+            "total": [{"$count": "count"}]
+        }}
+    ]
+    cursor = await config.timeline_collection.aggregate(pipeline, allowDiskUse=True)
+    summary = (await cursor.to_list(None))[0]
+    summary["total"] = summary["total"][0]["count"] if summary["total"] else 0
+    return summary
+
+async def find_timeline_event_key(incident_id: str, event_id: str) -> Optional[tuple]:
+    """The (timestamp, _id) sort key of one of an incident's events"""
+    event = await config.timeline_collection.find_one(
+        {"_id": ObjectId(event_id), "incident_id": incident_id},
+        {"timestamp": 1}
+    )
+    return (event["timestamp"], event["_id"]) if event else None
+
+async def find_timeline_version(incident_id: str):
+    """Read the incident's timeline version straight from the database, bypassing the cache"""
+    return await reads.do(
+        ("timeline_version", incident_id),
+        lambda: config.incidents_collection.find_one({"_id": ObjectId(incident_id)}, {"timeline_version": 1})
+    )
+
+async def count_timeline_events(incident_id: str, limit: Optional[int] = None) -> int:
+    """Count an incident's events, stopping at limit when only a threshold matters"""
+    options = {"limit": limit} if limit else {}
+    return await config.timeline_collection.count_documents({"incident_id": incident_id}, **options)
+
+async def delete_timeline_batch(incident_id: str, batch_size: int) -> int:
+    """Delete up to batch_size of an incident's events and return how many were removed
+    
+    Deleting in bounded batches keeps each write short, so a huge timeline never
+    holds up other writers for long.
+    """
+    cursor = config.timeline_collection.find({"incident_id": incident_id}, {"_id": 1}).limit(batch_size)
+    event_ids = [event["_id"] async for event in cursor]
+    if not event_ids:
+        return 0
+    result = await config.timeline_collection.delete_many({"_id": {"$in": event_ids}})
+    _forget_timeline(incident_id)
+    return result.deleted_count
+
+async def insert_timeline_event(event_dict: dict):
+    result = await config.timeline_collection.insert_one(event_dict)
+    _forget_timeline(event_dict["incident_id"])
+    return result
+
+async def insert_timeline_events(events: list) -> dict:
+    """Insert events unordered and return {index: error message} for any that failed"""
+    if not events:
+        return {}
+    try:
+        await config.timeline_collection.insert_many(events, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+    finally:
+        _forget_timeline(*{event["incident_id"] for event in events})
+    return {}
+
+async def update_timeline_event(event_id: str, update: dict):
+    """Apply an update and return the event as it was before, or None if it doesn't exist"""
+    previous = await config.timeline_collection.find_one_and_update(
+        {"_id": ObjectId(event_id)},
+        update,
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous:
+        _forget_timeline(previous["incident_id"], update.get("$set", {}).get("incident_id"))
+    return previous
+
+async def patch_timeline_event(event_id: str, update, condition: Optional[dict] = None):
+    """Apply an update and return the updated event, or None if it doesn't exist or fails the condition"""
+    event = await config.timeline_collection.find_one_and_update(
+        {"_id": ObjectId(event_id), **(condition or {})},
+        update,
+        return_document=ReturnDocument.AFTER
+    )
+    if event:
+        _forget_timeline(event["incident_id"])
+    return event
+
+async def timeline_event_exists(event_id: str) -> bool:
+    return await config.timeline_collection.find_one({"_id": ObjectId(event_id)}, {"_id": 1}) is not None
+
+async def delete_timeline_event(event_id: str):
+    """Delete an event and return it, or None if it doesn't exist"""
+    event = await config.timeline_collection.find_one_and_delete({"_id": ObjectId(event_id)})
+    if event:
+        _forget_timeline(event["incident_id"])
+    return event
+
+# Postmortem queries
+async def find_postmortem(incident_id: str):
+    """Fetch an incident's postmortem, served from the read cache when possible"""
+    postmortem = await postmortem_cache.get(incident_id)
+    if postmortem is None:
+        postmortem = await reads.do(("postmortem", incident_id), lambda: _load_postmortem(incident_id))
+    return postmortem
+
+async def _load_postmortem(incident_id: str):
+    since = postmortem_cache.clock.tick
+    postmortem = await config.postmortem_collection.find_one({"incident_id": incident_id})
+    if postmortem:
+        await postmortem_cache.fill(incident_id, postmortem, since)
+    return postmortem
+
+REVISION_WRITE_ATTEMPTS = 3
+
+async def upsert_postmortem(incident_id: str, update: dict):
+    """Apply an update to the incident's postmortem, creating it if needed, and record the revision
+    
+    The revision is written in the same transaction as the change. Without
+    transactions it is written just after, see _record_revision.
+    """
+    async def apply(session=None):
+        # The revision counter moves in the same atomic update as the change it numbers
+        return await config.postmortem_collection.find_one_and_update(
+            {"incident_id": incident_id},
+            {**update, "$inc": {"revision": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+    
+    if await transactions_supported():
+        async def apply_and_record(session):
+            postmortem = await apply(session)
+            await config.revisions_collection.insert_one(revision_document(postmortem, update), session=session)
+            return postmortem
+        
+        async with config.client.start_session() as session:
+            postmortem = await session.with_transaction(apply_and_record)
+    else:
+        postmortem = await apply()
+        await _record_revision(postmortem, update)
+    _forget_reads(incident_id)
+    await postmortem_cache.set(incident_id, postmortem)
+    return postmortem
+
+async def _record_revision(postmortem: dict, update: dict):
+    """Record a revision outside a transaction, after the change it describes
+    
+    A delta is only written if the revision before it is there; otherwise this
+    one is a snapshot, so a revision that failed to record never makes later
+    ones impossible to rebuild. The change itself is already saved, so a write
+    that keeps failing is logged rather than failing the request.
+    """
+    document = revision_document(postmortem, update)
+    if "delta" in document:
+        previous = await config.revisions_collection.find_one(
+            {"incident_id": postmortem["incident_id"], "revision": document["revision"] - 1}, {"_id": 1}
+        )
+        if previous is None:
+            document = revision_document(postmortem, update, snapshot=True)
+    for attempt in range(REVISION_WRITE_ATTEMPTS):
+        try:
+            await config.revisions_collection.insert_one(document)
+            return
+        except DuplicateKeyError:
+            # An earlier attempt was written after all
+            return
+        except PyMongoError as e:
+            error = e
+            await asyncio.sleep(0.1 * (attempt + 1))
+    logger.error(
+        "Could not record revision %s of the postmortem for incident %s: %s",
+        document["revision"], postmortem["incident_id"], error
+    )
+
+async def find_postmortem_revisions(incident_id: str, after: int = 0, limit: int = 100) -> list:
+    """An incident's postmortem revisions in order, starting after a revision number"""
+    cursor = config.revisions_collection.find(
+        {"incident_id": incident_id, "revision": {"$gt": after}}
+    ).sort("revision", 1).limit(limit)
+    return await cursor.to_list(None)
+
+async def find_revision_chain(incident_id: str, revision: int) -> list:
+    """Every revision from the scheduled snapshot of a revision up to it, in order"""
+    cursor = config.revisions_collection.find(
+        {"incident_id": incident_id, "revision": {"$gte": snapshot_revision(revision), "$lte": revision}}
+    ).sort("revision", 1)
+    return await cursor.to_list(None)
+
+# Report queries
+# A $lookup returns its matches as one array inside one document, which MongoDB
+# caps at 16MB. Reports inline at most REPORT_LOOKUP_MAX_EVENTS events; longer
+# timelines are read afterwards through their own cursor.
+REPORT_LOOKUP_MAX_EVENTS = 1000
+
+def _report_timeline_lookups(timeline_limit: Optional[int], summary: bool) -> list:
+    """$lookup stages adding an incident's timeline, up to REPORT_LOOKUP_MAX_EVENTS events, and its event count"""
+    if timeline_limit and timeline_limit <= REPORT_LOOKUP_MAX_EVENTS:
+        timeline_pipeline = [{"$sort": {"timestamp": -1}}, {"$limit": timeline_limit}, {"$sort": {"timestamp": 1}}]
+    else:
+        # Too long to inline; _complete_timeline replaces it, so any events will do
+        timeline_pipeline = [{"$sort": {"timestamp": 1}}, {"$limit": REPORT_LOOKUP_MAX_EVENTS + 1}]
+    timeline_pipeline.append({"$project": TIMELINE_EVENT_SUMMARY_PROJECTION if summary else TIMELINE_EVENT_PROJECTION})
+    return [
+        {"$lookup": {
+            "from": config.timeline_collection.name,
+            "localField": "incident_key",
+            "foreignField": "incident_id",
+            "pipeline": timeline_pipeline,
+            "as": "timeline"
+        }},
+        {"$lookup": {
+            "from": config.timeline_collection.name,
+            "localField": "incident_key",
+            "foreignField": "incident_id",
+            "pipeline": [{"$count": "count"}],
+            "as": "timeline_count"
+        }},
+    ]
+
+def _report_postmortem_lookup() -> dict:
+    return {"$lookup": {
+        "from": config.postmortem_collection.name,
+        "localField": "incident_key",
+        "foreignField": "incident_id",
+        "as": "postmortem"
+    }}
+
+def _report_from(incident: dict) -> dict:
+    """Split an aggregated incident into the report shape"""
+    incident.pop("incident_key")
+    timeline_count = incident.pop("timeline_count", [])
+    postmortem = incident.pop("postmortem")
+    return {
+        "incident": incident,
+        "timeline": incident.pop("timeline", []),
+        "timeline_count": timeline_count[0]["count"] if timeline_count else 0,
+        "postmortem": postmortem[0] if postmortem else None
+    }
+
+async def _complete_timeline(report: dict, timeline_limit: Optional[int], summary: bool) -> dict:
+    """Read the timeline through a cursor when it was too long to inline in the report"""
+    expected = min(report["timeline_count"], timeline_limit or report["timeline_count"])
+    if len(report["timeline"]) >= expected:
+        return report
+    incident_id = str(report["incident"]["_id"])
+    projection = TIMELINE_EVENT_SUMMARY_PROJECTION if summary else TIMELINE_EVENT_PROJECTION
+    if timeline_limit:
+        cursor = config.timeline_collection.find({"incident_id": incident_id}, projection).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(timeline_limit)
+        report["timeline"] = list(reversed(await cursor.to_list(None)))
+    else:
+        cursor = config.timeline_collection.find({"incident_id": incident_id}, projection).sort(
+            [("timestamp", 1), ("_id", 1)]
+        )
+        report["timeline"] = await cursor.to_list(None)
+    return report
+
+async def find_report(incident_id: str, timeline_limit: Optional[int] = None, summary: bool = False):
+    """Fetch an incident with its timeline and postmortem in a single aggregation
+    
+    timeline_limit keeps only the most recent events and summary drops the
+    free-text fields from each event, bounding the size of the report.
+    """
+    pipeline = [
+        {"$match": {"_id": ObjectId(incident_id)}},
+        # Timeline and postmortem documents reference the incident by its string ID
+        {"$addFields": {"incident_key": {"$toString": "$_id"}}},
+        *_report_timeline_lookups(timeline_limit, summary),
+        _report_postmortem_lookup(),
+    ]
+    cursor = await config.incidents_collection.aggregate(pipeline)
+    reports = await cursor.to_list(1)
+    if not reports:
+        return None
+    return await _complete_timeline(_report_from(reports[0]), timeline_limit, summary)
+
+REPORT_EXPORT_BATCH_SIZE = 50
+
+async def iter_reports(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    timeline_limit: Optional[int] = None,
+    summary: bool = False,
+    include_timeline: bool = True
+):
+    """Yield the reports of incidents created in a range that have a postmortem, oldest first
+    
+    Everything comes from one aggregation cursor read in small batches, so
+    memory use doesn't grow with the number of incidents. Timelines too long
+    to inline are read one incident at a time.
+    """
+    pipeline = [
+        {"$match": _created_between(start, end)},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$addFields": {"incident_key": {"$toString": "$_id"}}},
+        # Drop incidents without a postmortem before paying for their timelines
+        _report_postmortem_lookup(),
+        {"$match": {"postmortem": {"$ne": []}}},
+    ]
+    if include_timeline:
+        pipeline += _report_timeline_lookups(timeline_limit, summary)
+    cursor = await config.incidents_collection.aggregate(
+        pipeline, allowDiskUse=True, batchSize=REPORT_EXPORT_BATCH_SIZE
+    )
+    async for incident in cursor:
+        report = _report_from(incident)
+        if include_timeline:
+            report = await _complete_timeline(report, timeline_limit, summary)
+        yield report
+
+# Analytics queries
+def _created_between(start: Optional[datetime], end: Optional[datetime]) -> dict:
+    created_at = {}
+    if start:
+        created_at["$gte"] = start
+    if end:
+        created_at["$lt"] = end
+    return {"created_at": created_at} if created_at else {}
+
+async def count_incidents_by_bucket(unit: str, group_by: str, start=None, end=None) -> list:
+    """Count incidents per time bucket of created_at and per value of group_by"""
+    pipeline = [
+        {"$match": _created_between(start, end)},
+        {"$group": {
+            "_id": {
+                "bucket": {"$dateTrunc": {"date": "$created_at", "unit": unit}},
+                "key": f"${group_by}"
+            },
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id.bucket": 1, "_id.key": 1}}
+    ]
+    cursor = await config.incidents_collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+async def resolution_times(group_by: Optional[str] = None, start=None, end=None) -> list:
+    """Mean/min/max time from created_at to resolved_at for resolved incidents, in milliseconds"""
+    pipeline = [
+        {"$match": {**_created_between(start, end), "resolved_at": {"$ne": None}}},
+        {"$project": {"key": f"${group_by}" if group_by else {"$literal": None}, "duration": {"$subtract": ["$resolved_at", "$created_at"]}}},
+        {"$group": {
+            "_id": "$key",
+            "incidents": {"$sum": 1},
+            "mean_ms": {"$avg": "$duration"},
+            "min_ms": {"$min": "$duration"},
+            "max_ms": {"$max": "$duration"}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    cursor = await config.incidents_collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+async def response_times(group_by: Optional[str] = None, start=None, end=None) -> list:
+    """Mean time from created_at to the first Detection and first Mitigation event, in milliseconds"""
+    def first_event(event_type: str) -> dict:
+        return {"$first": {"$map": {
+            "input": {"$filter": {"input": "$milestones", "cond": {"$eq": ["$$this._id", event_type]}}},
+            "in": "$$this.first"
+        }}}
+    
+    pipeline = [
+        {"$match": _created_between(start, end)},
+        {"$project": {
+            "key": f"${group_by}" if group_by else {"$literal": None},
+            "created_at": 1,
+            "incident_key": {"$toString": "$_id"}
+        }},
+        # First timestamp of each milestone event type, computed per incident on the server
+        {"$lookup": {
+            "from": config.timeline_collection.name,
+            "localField": "incident_key",
+            "foreignField": "incident_id",
+            "pipeline": [
+                {"$match": {"event_type": {"$in": [EventType.DETECTION.value, EventType.MITIGATION.value]}}},
+                {"$group": {"_id": "$event_type", "first": {"$min": "$timestamp"}}}
+            ],
+            "as": "milestones"
+        }},
+        {"$project": {
+            "key": 1,
+            "time_to_detection": {"$subtract": [first_event(EventType.DETECTION.value), "$created_at"]},
+            "time_to_mitigation": {"$subtract": [first_event(EventType.MITIGATION.value), "$created_at"]}
+        }},
+        # $avg skips incidents without the milestone, whose duration is null
+        {"$group": {
+            "_id": "$key",
+            "incidents": {"$sum": 1},
+            "detected": {"$sum": {"$cond": [{"$eq": ["$time_to_detection", None]}, 0, 1]}},
+            "mitigated": {"$sum": {"$cond": [{"$eq": ["$time_to_mitigation", None]}, 0, 1]}},
+            "mean_time_to_detection_ms": {"$avg": "$time_to_detection"},
+            "mean_time_to_mitigation_ms": {"$avg": "$time_to_mitigation"}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    cursor = await config.incidents_collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+# Search queries
+async def text_search(collection, text: str, fields: dict, limit: int) -> list:
+    """Best-scoring $text matches in a collection, each with its textScore as "score" """
+    cursor = collection.find(
+        {"$text": {"$search": text}},
+        {**fields, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    return await cursor.to_list(None)
+
+async def search_incidents(text: str, limit: int) -> list:
+    return await text_search(config.incidents_collection, text, INCIDENT_PROJECTION, limit)
+
+async def search_timeline(text: str, limit: int) -> list:
+    return await text_search(config.timeline_collection, text, {"incident_id": 1, "description": 1}, limit)
+
+async def search_postmortems(text: str, limit: int) -> list:
+    return await text_search(config.postmortem_collection, text, {"incident_id": 1, "root_cause": 1, "contributing_factors": 1}, limit)
+
+# Archival queries
+ARCHIVE_SUFFIX = "_archive"
+
+def archive_collection(collection):
+    """The cold collection that archived documents of a hot collection are moved to"""
+    return config.db[collection.name + ARCHIVE_SUFFIX]
+
+def archivable_query(cutoff: datetime) -> dict:
+    """Closed incidents resolved before the cutoff"""
+    return {"status": IncidentStatus.CLOSED.value, "resolved_at": {"$lt": cutoff}}
+
+async def find_archivable_incidents(cutoff: datetime, limit: int) -> tuple:
+    """The next batch of incidents to archive, with their postmortems and postmortem revisions
+    
+    Timelines can be far larger and are read in batches with iter_timeline_batches.
+    """
+    # Each batch is removed once archived, so the next one is simply the first match again
+    cursor = config.incidents_collection.find(archivable_query(cutoff)).limit(limit)
+    incidents = await cursor.to_list(None)
+    incident_ids = [str(incident["_id"]) for incident in incidents]
+    postmortems = await config.postmortem_collection.find({"incident_id": {"$in": incident_ids}}).to_list(None)
+    revisions = await config.revisions_collection.find({"incident_id": {"$in": incident_ids}}).to_list(None)
+    return incidents, postmortems, revisions
+
+async def iter_timeline_batches(incident_id: str, batch_size: int):
+    """Yield an incident's events in order, batch_size at a time, from a single cursor"""
+    cursor = config.timeline_collection.find({"incident_id": incident_id}).sort(
+        [("timestamp", 1), ("_id", 1)]
+    ).batch_size(batch_size)
+    batch = []
+    async for event in cursor:
+        batch.append(event)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _insert_ignoring_duplicates(collection, documents: list):
+    # A resumed job may copy documents it already copied before being interrupted
+    if not documents:
+        return
+    try:
+        await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+async def copy_timeline_to_archive(events: list):
+    await _insert_ignoring_duplicates(archive_collection(config.timeline_collection), events)
+
+async def copy_to_archive(incidents: list, postmortems: list, revisions: list):
+    """Copy documents into the cold collections, keeping their IDs"""
+    await _insert_ignoring_duplicates(archive_collection(config.incidents_collection), incidents)
+    await _insert_ignoring_duplicates(archive_collection(config.postmortem_collection), postmortems)
+    await _insert_ignoring_duplicates(archive_collection(config.revisions_collection), revisions)
+
+async def delete_archived(incident_ids: list):
+    """Remove archived incidents from the hot collections, children first
+    
+    If this is interrupted the incidents are still in place and the next run
+    archives them again, so nothing is ever left without its incident.
+    """
+    await config.timeline_collection.delete_many({"incident_id": {"$in": incident_ids}})
+    await config.postmortem_collection.delete_many({"incident_id": {"$in": incident_ids}})
+    await config.revisions_collection.delete_many({"incident_id": {"$in": incident_ids}})
+    await config.incidents_collection.delete_many({"_id": {"$in": [ObjectId(incident_id) for incident_id in incident_ids]}})
+    _forget_reads(*incident_ids)
+    for incident_id in incident_ids:
+        await incident_cache.delete(incident_id)
+        await postmortem_cache.delete(incident_id)
+
+# Job queries
+async def insert_job(job: dict):
+    return await config.jobs_collection.insert_one(job)
+
+async def find_job(job_id: str):
+    return await config.jobs_collection.find_one({"_id": ObjectId(job_id)})
+
+async def find_jobs(status: Optional[str] = None, limit: int = 50) -> list:
+    query = {"status": status} if status else {}
+    return await config.jobs_collection.find(query).sort("_id", -1).limit(limit).to_list(None)
+
+async def claim_job(job_id, owner: str, lease_until: datetime, now: datetime):
+    """Take a pending job, or one whose previous owner's lease expired, and return it"""
+    return await config.jobs_collection.find_one_and_update(
+        {
+            "_id": ObjectId(job_id),
+            "status": {"$in": ["pending", "running"]},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": {"status": "running", "owner": owner, "lease_until": lease_until, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def find_resumable_job_ids(now: datetime) -> list:
+    """Unfinished jobs nobody currently holds a lease on"""
+    cursor = config.jobs_collection.find(
+        {"status": {"$in": ["pending", "running"]}, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"_id": 1}
+    )
+    return [job["_id"] async for job in cursor]
+
+async def update_job(job_id, owner: str, fields: dict):
+    """Record progress on a job, only while this worker still owns it"""
+    result = await config.jobs_collection.update_one(
+        {"_id": ObjectId(job_id), "owner": owner},
+        {"$set": fields}
+    )
+    return result.modified_count > 0
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+# Postmortem history. Every write to a postmortem appends a revision to the
+# postmortem_revisions collection. Most revisions store only the change the
+# write made: the fields it set and the items it added to lists. Every
+# SNAPSHOT_INTERVAL-th revision stores the whole postmortem instead, so
+# rebuilding any revision replays at most SNAPSHOT_INTERVAL - 1 deltas on top
+# of the nearest snapshot. Revision numbers come from a counter incremented in
+# the same atomic update as the change, so replaying deltas in revision order
+# reproduces exactly the sequence of states the postmortem went through. A
+# revision may also be recorded as a snapshot out of turn, when the one before
+# it is missing; rebuilding starts from the latest snapshot it can find.
+
+SNAPSHOT_INTERVAL = 10
+POSTMORTEM_FIELDS = ("root_cause", "contributing_factors", "impact", "action_items", "created_at", "updated_at")
+
+def snapshot_revision(revision: int) -> int:
+    """The snapshot a revision is rebuilt from: revisions 1, 11, 21, ... are snapshots"""
+    return revision - (revision - 1) % SNAPSHOT_INTERVAL
+
+def postmortem_state(postmortem: dict) -> dict:
+    return {field: postmortem[field] for field in POSTMORTEM_FIELDS if field in postmortem}
+
+def revision_document(postmortem: dict, update: dict, snapshot: bool = False) -> dict:
+    """The revision to record for an update, given the postmortem it produced"""
+    revision = postmortem["revision"]
+    document = {
+        "incident_id": postmortem["incident_id"],
+        "revision": revision,
+        "created_at": postmortem.get("updated_at") or datetime.now()
+    }
+    if snapshot or snapshot_revision(revision) == revision:
+        document["snapshot"] = postmortem_state(postmortem)
+        return document
+    delta = {}
+    if update.get("$set"):
+        delta["set"] = update["$set"]
+    if update.get("$addToSet"):
+        delta["add_to_set"] = {field: spec["$each"] for field, spec in update["$addToSet"].items()}
+    document["delta"] = delta
+    return document
+
+def apply_delta(state: dict, delta: dict) -> dict:
+    """Replay a recorded change the way MongoDB applied it"""
+    state.update(delta.get("set", {}))
+    for field, values in delta.get("add_to_set", {}).items():
+        items = state.setdefault(field, [])
+        for value in values:
+            if value not in items:
+                items.append(value)
+    return state
+
+def rebuild(revisions: list, revision: int):
+    """The postmortem at a revision from the latest snapshot before it and the deltas after that
+
+    Takes the revisions since its scheduled snapshot, sorted by revision.
+    Returns None if the snapshot or any revision after it is missing.
+    """
+    snapshots = [index for index, document in enumerate(revisions) if "snapshot" in document]
+    if not snapshots:
+        return None
+    chain = revisions[snapshots[-1]:]
+    expected = list(range(chain[0]["revision"], revision + 1))
+    if [document["revision"] for document in chain] != expected:
+        return None
+    state = {field: list(value) if isinstance(value, list) else value for field, value in chain[0]["snapshot"].items()}
+    for document in chain[1:]:
+        apply_delta(state, document["delta"])
+    return state
+
+def changed_fields(document: dict) -> list:
+    if "snapshot" in document:
+        return sorted(document["snapshot"])
+    delta = document["delta"]
+    return sorted(set(delta.get("set", {})) | set(delta.get("add_to_set", {})))
@@ -1,3 +1,19 @@
+import base64
+from bson.objectid import ObjectId
+from datetime import datetime
+from database.revisions import changed_fields
+
+# Projections limiting queries to the fields the serializers below read
+INCIDENT_PROJECTION = {
+    field: 1 for field in ("title", "description", "severity", "status", "created_at", "updated_at", "resolved_at", "summary", "version")
+}
+TIMELINE_EVENT_PROJECTION = {
+    field: 1 for field in ("incident_id", "event_type", "description", "timestamp", "created_by", "version")
+}
+TIMELINE_EVENT_SUMMARY_PROJECTION = {
+    field: 1 for field in ("incident_id", "event_type", "timestamp")
+}
+
 # Incident Schemas
 def incident_serializer(incident) -> dict:
     return {
@@ -8,11 +24,14 @@ def incident_serializer(incident) -> dict:
         "status": incident["status"],
         "created_at": incident.get("created_at"),
         "updated_at": incident.get("updated_at"),
-        "resolved_at": incident.get("resolved_at")
+        "resolved_at": incident.get("resolved_at"),
+        "summary": incident.get("summary"),
+        "version": incident.get("version", 0)
     }
 
 def incidents_serializer(incidents) -> list:
-    return [incident_serializer(incident) for incident in incidents]
+    serialize = incident_serializer
+    return [serialize(incident) for incident in incidents]
 
 # Timeline Event Schemas
 def timeline_event_serializer(event) -> dict:
@@ -22,11 +41,21 @@ def timeline_event_serializer(event) -> dict:
         "event_type": event["event_type"],
         "description": event["description"],
         "timestamp": event.get("timestamp"),
-        "created_by": event.get("created_by", "system")
+        "created_by": event.get("created_by", "system"),
+        "version": event.get("version", 0)
     }
 
 def timeline_events_serializer(events) -> list:
-    return [timeline_event_serializer(event) for event in events]
+    serialize = timeline_event_serializer
+    return [serialize(event) for event in events]
+
+def timeline_event_summary_serializer(event) -> dict:
+    return {
+        "id": str(event["_id"]),
+        "incident_id": event["incident_id"],
+        "event_type": event["event_type"],
+        "timestamp": event.get("timestamp")
+    }
 
 # Postmortem Schemas
 def postmortem_serializer(postmortem) -> dict:
@@ -38,5 +67,56 @@ def postmortem_serializer(postmortem) -> dict:
         "impact": postmortem.get("impact", ""),
         "action_items": postmortem.get("action_items", []),
         "created_at": postmortem.get("created_at"),
-        "updated_at": postmortem.get("updated_at")
+        "updated_at": postmortem.get("updated_at"),
+        "revision": postmortem.get("revision", 0)
+    }
+
+def postmortem_revision_serializer(document) -> dict:
+    return {
+        "revision": document["revision"],
+        "kind": "snapshot" if "snapshot" in document else "delta",
+        "changed_fields": changed_fields(document),
+        "created_at": document.get("created_at")
+    }
+
+# Pagination Schemas
+def encode_cursor(document) -> str:
+    """Encode the (created_at, _id) sort key of a document as an opaque cursor"""
+    # A missing or null created_at is encoded as an empty string
+    created_at = document.get("created_at")
+    key = f"{created_at.isoformat() if created_at else ''}|{document['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_cursor back into (created_at or None, ObjectId)"""
+    created_at, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at) if created_at else None, ObjectId(object_id)
+
+# Report Schemas
+def report_serializer(report, postmortem=None, summary: bool = False) -> dict:
+    timeline_serializer = timeline_event_summary_serializer if summary else timeline_event_serializer
+    postmortem = postmortem or report["postmortem"]
+    return {
+        "incident": incident_serializer(report["incident"]),
+        "timeline": [timeline_serializer(event) for event in report["timeline"]],
+        "timeline_count": report["timeline_count"],
+        "postmortem": postmortem_serializer(postmortem) if postmortem else None
+    }
+
+# Job Schemas
+def job_serializer(job) -> dict:
+    total = job.get("total")
+    processed = job.get("processed", 0)
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "params": job.get("params", {}),
+        "processed": processed,
+        "total": total,
+        "progress": min(processed / total, 1.0) if total else None,
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+        "finished_at": job.get("finished_at")
     }
@@ -1,12 +1,75 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from services import incident_service, timeline_service, postmortem_service
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+import config
+from config import TIMELINE_STREAM_SOURCE
+from database.cache import incident_cache, postmortem_cache
+from database.coalesce import reads
+from database.indexes import ensure_indexes
+from middleware.metrics import MetricsMiddleware, render_metrics
+from middleware.rate_limit import RateLimitMiddleware, create_rate_limit_backend
+from services.ingest_queue import ingest_queue
+from services import incident_service, timeline_service, postmortem_service, analytics_service, search_service, timeline_stream, job_service
+
+READINESS_PING_TIMEOUT = 2
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect, warm up and start background tasks before serving requests
+    
+    The lifespan runs in each worker process after the server forks, so every
+    worker builds its own client and connection pool.
+    """
+    app.state.ready = False
+    config.connect()
+    # Pay for server selection and the TLS handshake now, not on the first request
+    await config.client.admin.command("ping")
+    await ensure_indexes()
+    # Pick up jobs left unfinished by workers that stopped
+    await job_service.resume_jobs()
+    ingest_queue.start()
+    watcher = None
+    if TIMELINE_STREAM_SOURCE == "change_stream":
+        watcher = asyncio.create_task(timeline_stream.watch_timeline())
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    # Write every accepted event before the client goes away
+    await ingest_queue.drain()
+    if watcher:
+        watcher.cancel()
+    await job_service.stop_jobs()
+    await config.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Incident Timeline and Postmortem API",
     description="API for managing incidents, timeline events, and postmortem reports",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
+
+# Token-bucket rate limiting per client and route; added first so it runs
+# inside the metrics middleware, which then records rejected requests too
+if config.RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        routes=app.router.routes,
+        backend=create_rate_limit_backend(config.RATE_LIMIT_REDIS_URL),
+        rate=config.RATE_LIMIT_RATE,
+        burst=config.RATE_LIMIT_BURST,
+        route_limits=config.RATE_LIMIT_ROUTES,
+        trust_forwarded_for=config.RATE_LIMIT_TRUST_FORWARDED_FOR
+    )
+
+# Record per-route latency, payload size and database use
+app.add_middleware(
+    MetricsMiddleware,
+    server_timing=config.METRICS_SERVER_TIMING,
+    slow_request_ms=config.SLOW_REQUEST_MS
 )
 
 # Configure CORS
@@ -37,6 +100,24 @@ app.include_router(
     tags=["Postmortem"]
 )
 
+app.include_router(
+    analytics_service.router,
+    prefix="/api/analytics",
+    tags=["Analytics"]
+)
+
+app.include_router(
+    search_service.router,
+    prefix="/api/search",
+    tags=["Search"]
+)
+
+app.include_router(
+    job_service.router,
+    prefix="/api/jobs",
+    tags=["Jobs"]
+)
+
 # Root endpoint
 @app.get("/", tags=["Root"])
 async def root():
@@ -47,7 +128,10 @@ async def root():
         "services": {
             "incidents": "/api/incidents",
             "timeline": "/api/timeline",
-            "postmortem": "/api/postmortem"
+            "postmortem": "/api/postmortem",
+            "analytics": "/api/analytics",
+            "search": "/api/search",
+            "jobs": "/api/jobs"
         },
         "documentation": {
             "swagger": "/docs",
@@ -55,13 +139,40 @@ async def root():
         }
     }
 
-# Health check endpoint
+# Health check endpoints
 @app.get("/health", tags=["Health"])
+@app.get("/health/live", tags=["Health"])
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check: the process is up and serving requests, without touching any state"""
     return {
         "status": "healthy",
         "service": "Incident Timeline and Postmortem API"
     }
 
+@app.get("/health/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness check: startup finished and the database answers a ping, with runtime stats"""
+    ready = getattr(app.state, "ready", False)
+    if ready:
+        try:
+            await asyncio.wait_for(config.client.admin.command("ping"), READINESS_PING_TIMEOUT)
+        except Exception:
+            ready = False
+    return ORJSONResponse({
+        "status": "ready" if ready else "not ready",
+        "service": "Incident Timeline and Postmortem API",
+        "pool": config.pool_stats.stats(),
+        "caches": {
+            "incidents": incident_cache.stats(),
+            "postmortems": postmortem_cache.stats()
+        },
+        "timeline_stream": timeline_stream.timeline_broker.stats(),
+        "ingest_queue": ingest_queue.stats(),
+        "read_coalescing": reads.stats()
+    }, status_code=200 if ready else 503)
 
+# Metrics endpoint
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    """Request and database metrics in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
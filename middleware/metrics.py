@@ -0,0 +1,181 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+from pymongo.monitoring import CommandListener
+
+logger = logging.getLogger(__name__)
+
+# Request-level performance metrics, rendered in the Prometheus text format on
+# /metrics. The middleware times each request and measures its payload; the
+# command listener attributes every MongoDB command to the request that issued
+# it through a context variable, so slow endpoints can be split into database
+# time and everything else.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+class Histogram:
+    """Cumulative histogram per label set, as Prometheus expects"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            for bound, count in zip(self.buckets, series["buckets"]):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series['sum']}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series['count']}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+            lines.append(f"{self.name}{{{label_text}}} {value}")
+        return lines
+
+REQUEST_LABELS = ("method", "route", "status")
+ROUTE_LABELS = ("method", "route")
+COMMAND_LABELS = ("command",)
+
+request_duration = Histogram("http_request_duration_seconds", "Time to complete a request", LATENCY_BUCKETS)
+response_size = Histogram("http_response_size_bytes", "Size of the response body", SIZE_BUCKETS)
+db_commands_per_request = Histogram("db_commands_per_request", "MongoDB commands issued per request", COUNT_BUCKETS)
+db_time_per_request = Histogram("db_time_per_request_seconds", "Time spent in MongoDB per request", LATENCY_BUCKETS)
+db_command_duration = Histogram("db_command_duration_seconds", "Duration of MongoDB commands", LATENCY_BUCKETS)
+db_command_failures = Counter("db_command_failures_total", "MongoDB commands that failed")
+ingest_flush_duration = Histogram("timeline_ingest_flush_seconds", "Time to write a batch of queued timeline events", LATENCY_BUCKETS)
+ingest_batch_size = Histogram("timeline_ingest_batch_size", "Timeline events written per flush", (1, 10, 50, 100, 250, 500, 1000, 5000))
+
+def render_metrics() -> str:
+    lines = []
+    lines += request_duration.render(REQUEST_LABELS)
+    lines += response_size.render(ROUTE_LABELS)
+    lines += db_commands_per_request.render(ROUTE_LABELS)
+    lines += db_time_per_request.render(ROUTE_LABELS)
+    lines += db_command_duration.render(COMMAND_LABELS)
+    lines += db_command_failures.render(COMMAND_LABELS)
+    lines += ingest_flush_duration.render(())
+    lines += ingest_batch_size.render(())
+    return "\n".join(lines) + "\n"
+
+# Database command tracking
+class RequestStats:
+    """Database activity of the request being handled in the current context"""
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_seconds = 0.0
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+class CommandMetrics(CommandListener):
+    """Records MongoDB command durations, globally and for the current request"""
+
+    def started(self, event):
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_commands += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        db_command_failures.inc((event.command_name,))
+        self._finished(event)
+
+    def _finished(self, event):
+        seconds = event.duration_micros / 1_000_000
+        db_command_duration.observe((event.command_name,), seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_seconds += seconds
+
+# Request middleware
+class MetricsMiddleware:
+    """ASGI middleware recording latency, payload size and database use per route"""
+
+    def __init__(self, app, server_timing: bool = False, slow_request_ms: float = 1000):
+        self.app = app
+        self.server_timing = server_timing
+        self.slow_request_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal status, size, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.setdefault("headers", [])
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in headers
+                )
+                if self.server_timing:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    timing = f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_commands} commands", app;dur={elapsed:.1f}'
+                    headers.append((b"server-timing", timing.encode()))
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            duration = time.perf_counter() - start
+            # Label by route template, not raw path, to keep the number of series bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+
+            request_duration.observe((method, route_path, str(status)), duration)
+            response_size.observe((method, route_path), size)
+            db_commands_per_request.observe((method, route_path), stats.db_commands)
+            db_time_per_request.observe((method, route_path), stats.db_seconds)
+
+            if duration > self.slow_request_seconds and not streaming:
+                logger.warning(
+                    "Slow request: %s %s status=%s duration=%.0fms db_commands=%d db_time=%.0fms bytes=%d",
+                    method, scope["path"], status, duration * 1000,
+                    stats.db_commands, stats.db_seconds * 1000, size
+                )
@@ -0,0 +1,157 @@
+import math
+import time
+from collections import OrderedDict
+import orjson
+from starlette.routing import Match
+
+# Token-bucket rate limiting per client and route. Each (client, route
+# template) pair has a bucket holding up to `burst` tokens that refills at
+# `rate` tokens per second; a request takes one token or is answered with 429.
+# Buckets live in this process by default, or in Redis so that every worker
+# enforces the same limit.
+
+class LocalTokenBuckets:
+    """In-process buckets, evicting the least recently used beyond max_keys"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> tuple:
+        """Take a token; returns (allowed, tokens left, seconds until the next token)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) / rate
+
+class RedisTokenBuckets:
+    """Buckets shared by all workers, updated atomically by a Lua script
+
+    Requires the optional redis package. The script reads the clock of the
+    Redis server, so workers with skewed clocks still agree.
+    """
+
+    SCRIPT = """
+    local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int) -> tuple:
+        allowed, tokens = await self._script(keys=[f"ratelimit:{key}"], args=[rate, burst])
+        tokens = float(tokens)
+        return bool(allowed), tokens, 0.0 if allowed else (1 - tokens) / rate
+
+def create_rate_limit_backend(redis_url: str = None, max_keys: int = 100000):
+    """Share buckets through Redis when a URL is configured, otherwise keep them in-process"""
+    if redis_url:
+        return RedisTokenBuckets(redis_url)
+    return LocalTokenBuckets(max_keys)
+
+class RateLimitMiddleware:
+    """ASGI middleware applying a token bucket per client and route template
+
+    routes is the application's route list, used to find the template of a
+    request before it is routed so that /api/incidents/{incident_id} is one
+    route whatever the ID. route_limits overrides (rate, burst) per template.
+    """
+
+    def __init__(
+        self,
+        app,
+        routes: list,
+        backend=None,
+        rate: float = 20.0,
+        burst: int = 40,
+        route_limits: dict = None,
+        exempt_prefixes: tuple = ("/health", "/metrics"),
+        trust_forwarded_for: bool = False
+    ):
+        self.app = app
+        self.routes = routes
+        self.backend = backend or LocalTokenBuckets()
+        self.rate = rate
+        self.burst = burst
+        self.route_limits = route_limits or {}
+        self.exempt_prefixes = exempt_prefixes
+        self.trust_forwarded_for = trust_forwarded_for
+
+    def _client(self, scope) -> str:
+        if self.trust_forwarded_for:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def _route(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        route_path = getattr(route, "path", "unmatched")
+        if route is not None:
+            # Lets the metrics middleware label rejected requests by route too
+            scope["route"] = route
+        rate, burst = self.route_limits.get(route_path, (self.rate, self.burst))
+        key = f"{self._client(scope)}|{scope['method']}|{route_path}"
+        allowed, tokens, retry_after = await self.backend.take(key, rate, burst)
+        limit_headers = [
+            (b"x-ratelimit-limit", str(burst).encode()),
+            (b"x-ratelimit-remaining", str(int(tokens)).encode())
+        ]
+
+        if not allowed:
+            body = orjson.dumps({"detail": "Rate limit exceeded, retry later"})
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(retry_after)).encode()),
+                    *limit_headers
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).extend(limit_headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, HTTPException, Query
+from database import repository
+from datetime import datetime
+from typing import Optional
+
+router = APIRouter()
+
+# All analytics run as aggregations on the server; only the aggregated rows
+# are sent back, never the underlying incidents or timeline events.
+
+def _seconds(milliseconds) -> Optional[float]:
+    return round(milliseconds / 1000, 1) if milliseconds is not None else None
+
+def _validate_range(start: Optional[datetime], end: Optional[datetime]):
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be earlier than 'to'")
+
+@router.get("/incident-counts")
+async def get_incident_counts(
+    bucket: str = Query("day", pattern="^(hour|day|week|month)$", description="Time bucket size"),
+    group_by: str = Query("severity", pattern="^(severity|status)$", description="Field to break counts down by"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only incidents created at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only incidents created before this time")
+):
+    """Count incidents per time bucket, broken down by severity or status"""
+    try:
+        _validate_range(start, end)
+        rows = await repository.count_incidents_by_bucket(bucket, group_by, start, end)
+        
+        buckets = {}
+        for row in rows:
+            bucket_start = row["_id"]["bucket"]
+            counts = buckets.setdefault(bucket_start, {"bucket": bucket_start, "total": 0, "counts": {}})
+            counts["counts"][row["_id"]["key"]] = row["count"]
+            counts["total"] += row["count"]
+        
+        return {
+            "status_code": 200,
+            "bucket": bucket,
+            "group_by": group_by,
+            "data": list(buckets.values())
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing incident counts: {str(e)}")
+
+@router.get("/mttr")
+async def get_mttr(
+    group_by: Optional[str] = Query(None, pattern="^(severity|status)$", description="Optional breakdown field"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only incidents created at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only incidents created before this time")
+):
+    """Mean time to resolve (created_at to resolved_at) for resolved incidents"""
+    try:
+        _validate_range(start, end)
+        rows = await repository.resolution_times(group_by, start, end)
+        
+        return {
+            "status_code": 200,
+            "group_by": group_by,
+            "data": [{
+                "group": row["_id"],
+                "resolved_incidents": row["incidents"],
+                "mttr_seconds": _seconds(row["mean_ms"]),
+                "min_seconds": _seconds(row["min_ms"]),
+                "max_seconds": _seconds(row["max_ms"])
+            } for row in rows]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing MTTR: {str(e)}")
+
+@router.get("/response-times")
+async def get_response_times(
+    group_by: Optional[str] = Query(None, pattern="^(severity|status)$", description="Optional breakdown field"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only incidents created at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only incidents created before this time")
+):
+    """Mean time from incident creation to the first Detection and first Mitigation timeline events"""
+    try:
+        _validate_range(start, end)
+        rows = await repository.response_times(group_by, start, end)
+        
+        return {
+            "status_code": 200,
+            "group_by": group_by,
+            "data": [{
+                "group": row["_id"],
+                "incidents": row["incidents"],
+                "detected_incidents": row["detected"],
+                "mitigated_incidents": row["mitigated"],
+                "mttd_seconds": _seconds(row["mean_time_to_detection_ms"]),
+                "mttm_seconds": _seconds(row["mean_time_to_mitigation_ms"])
+            } for row in rows]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing response times: {str(e)}")
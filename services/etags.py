@@ -0,0 +1,61 @@
+from fastapi import HTTPException, Response
+from datetime import datetime
+from typing import Optional
+
+# Strong ETags for conditional requests. Each ETag is built from values that
+# change whenever the representation does (an updated_at or a version
+# counter), so comparing them costs no more than reading those values.
+
+def make_etag(*parts) -> str:
+    return '"' + ".".join(str(part) for part in parts) + '"'
+
+def version_of(timestamp: Optional[datetime]) -> int:
+    """Millisecond precision matches what MongoDB stores"""
+    return int(timestamp.timestamp() * 1000) if timestamp else 0
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match or If-Match header value lists this ETag"""
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+# Optimistic concurrency. Writable documents carry a version counter that every
+# write increments; a conditional write names the version it expects and only
+# applies if the document still has it.
+
+def etag_parts(header: Optional[str]) -> Optional[list]:
+    """Split a single strong ETag back into the parts given to make_etag"""
+    if not header:
+        return None
+    header = header.strip()
+    if len(header) < 2 or not header.startswith('"') or not header.endswith('"') or "," in header:
+        return None
+    return header[1:-1].split(".")
+
+def expected_version(resource_id: str, if_match: Optional[str], version: Optional[int] = None) -> Optional[int]:
+    """The version a conditional write must find, from the request body or an If-Match header
+    
+    Returns None for an unconditional write. The ETag's second part is the
+    document version, as built by the services.
+    """
+    if version is not None:
+        return version
+    if not if_match or if_match.strip() == "*":
+        return None
+    parts = etag_parts(if_match)
+    if not parts or len(parts) < 2 or parts[0] != resource_id or not parts[1].isdigit():
+        raise HTTPException(status_code=412, detail="If-Match does not match the current version")
+    return int(parts[1])
+
+def version_filter(expected: Optional[int]) -> dict:
+    """Query clause for a conditional write; documents written before versioning count as version 0"""
+    if expected is None:
+        return {}
+    return {"version": expected if expected else {"$in": [0, None]}}
+
+# Pipeline expression incrementing the version, treating a missing one as 0
+NEXT_VERSION = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
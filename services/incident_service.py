@@ -1,13 +1,57 @@
-from fastapi import APIRouter, HTTPException, Query
-from config import incidents_collection
-from database.schemas import incident_serializer, incidents_serializer
-from database.models import Incident, IncidentStatus
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from database import repository
+from database.schemas import incident_serializer, incidents_serializer, encode_cursor, decode_cursor, job_serializer
+from database.models import Incident, IncidentStatus, IncidentStatusUpdate, IncidentUpdate
+from services import job_service
+from services.etags import (
+    make_etag, version_of, etag_matches, not_modified, expected_version, version_filter, NEXT_VERSION
+)
+from config import CASCADE_SYNC_LIMIT
 from bson.objectid import ObjectId
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+import orjson
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_INCIDENTS = 1000
+
+def _resolved_at_rule(status: str, now: datetime) -> dict:
+    """Pipeline $set fields that stamp resolved_at on the server when an incident is resolved or closed"""
+    # $ifNull keeps the original resolution time if the incident was already resolved
+    if status in [IncidentStatus.RESOLVED, IncidentStatus.CLOSED]:
+        return {"resolved_at": {"$ifNull": ["$resolved_at", now]}}
+    return {}
+
+def incident_etag(incident) -> str:
+    """ETag over the incident's own version and the parts of its summary kept by other writers"""
+    summary = incident.get("summary") or {}
+    return make_etag(
+        incident["_id"], incident.get("version", 0),
+        incident.get("timeline_version", 0), int(summary.get("has_postmortem", False))
+    )
+
+async def _conditional_update(incident_id: str, set_stage: dict, expected: Optional[int]):
+    """Apply a pipeline $set if the incident still has the expected version; 404 or 412 otherwise"""
+    updated = await repository.update_incident(
+        incident_id,
+        [{"$set": {**set_stage, "version": NEXT_VERSION}}],
+        version_filter(expected)
+    )
+    if updated:
+        return updated
+    # Only a failed write pays for telling the two cases apart
+    if expected is not None and await repository.find_existing_incident_ids([incident_id]):
+        raise HTTPException(status_code=412, detail="Incident was modified since the given version")
+    raise HTTPException(status_code=404, detail="Incident not found")
+
+def _split_ids(ids: List[str]) -> List[str]:
+    # Accept both ?ids=a,b and ?ids=a&ids=b, dropping duplicates but keeping order
+    return list(dict.fromkeys(part.strip() for value in ids for part in value.split(",") if part.strip()))
+
 @router.post("/", status_code=201)
 async def create_incident(incident: Incident):
     """Create a new incident"""
@@ -15,9 +59,11 @@ async def create_incident(incident: Incident):
         incident_dict = incident.dict()
         incident_dict["created_at"] = datetime.now()
         incident_dict["updated_at"] = datetime.now()
+        incident_dict["summary"] = dict(repository.EMPTY_SUMMARY)
+        incident_dict["version"] = 1
         
-        result = incidents_collection.insert_one(incident_dict)
-        created_incident = incidents_collection.find_one({"_id": result.inserted_id})
+        result = await repository.insert_incident(incident_dict)
+        created_incident = {**incident_dict, "_id": result.inserted_id}
         
         return {
             "status_code": 201,
@@ -27,12 +73,109 @@ async def create_incident(incident: Incident):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating incident: {str(e)}")
 
+@router.post("/bulk", status_code=201)
+async def create_incidents_bulk(incidents: List[Incident]):
+    """Create many incidents in one request with a single insert"""
+    try:
+        if len(incidents) > MAX_BULK_INCIDENTS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_INCIDENTS} incidents per request")
+        
+        now = datetime.now()
+        documents = []
+        for incident in incidents:
+            incident_dict = incident.dict()
+            incident_dict["created_at"] = now
+            incident_dict["updated_at"] = now
+            incident_dict["summary"] = dict(repository.EMPTY_SUMMARY)
+            incident_dict["version"] = 1
+            documents.append(incident_dict)
+        
+        # insert_many fills in each document's _id
+        errors = await repository.insert_incidents(documents) if documents else {}
+        results = [
+            {"index": index, "status": "error", "detail": errors[index]} if index in errors
+            else {"index": index, "status": "created", "data": incident_serializer(document)}
+            for index, document in enumerate(documents)
+        ]
+        
+        created = len(documents) - len(errors)
+        return ORJSONResponse({
+            "status_code": 201,
+            "message": f"{created} of {len(documents)} incidents created",
+            "created": created,
+            "failed": len(errors),
+            "data": results
+        }, status_code=201)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating incidents: {str(e)}")
+
+@router.patch("/bulk")
+async def update_incidents_status_bulk(update: IncidentStatusUpdate):
+    """Move several incidents to a new status in one bulk write"""
+    try:
+        incident_ids = list(dict.fromkeys(update.ids))
+        if len(incident_ids) > MAX_BULK_INCIDENTS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_INCIDENTS} incidents per request")
+        invalid_ids = [incident_id for incident_id in incident_ids if not ObjectId.is_valid(incident_id)]
+        if invalid_ids:
+            raise HTTPException(status_code=400, detail=f"Invalid incident ID format: {', '.join(invalid_ids)}")
+        if not incident_ids:
+            raise HTTPException(status_code=400, detail="No incident IDs given")
+        
+        now = datetime.now()
+        set_stage = {
+            "status": {"$literal": update.status},
+            "updated_at": now,
+            "version": NEXT_VERSION,
+            **_resolved_at_rule(update.status, now)
+        }
+        matched = await repository.update_incidents(incident_ids, [{"$set": set_stage}])
+        
+        # Only look for the missing IDs when some didn't match
+        not_found = []
+        if matched < len(incident_ids):
+            existing_ids = await repository.find_existing_incident_ids(incident_ids)
+            not_found = [incident_id for incident_id in incident_ids if incident_id not in existing_ids]
+        
+        return {
+            "status_code": 200,
+            "message": f"{matched} of {len(incident_ids)} incidents updated",
+            "updated": matched,
+            "not_found": not_found
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating incidents: {str(e)}")
+
+@router.post("/archive", status_code=202)
+async def archive_incidents(
+    older_than_days: int = Query(90, ge=1, description="Archive closed incidents resolved more than this many days ago"),
+    target: str = Query("collection", pattern="^(collection|file)$", description="Move to cold collections or a gzipped JSONL file")
+):
+    """Archive old closed incidents with their timelines and postmortems in the background"""
+    try:
+        job = await job_service.start_archive(older_than_days, target)
+        return ORJSONResponse({
+            "status_code": 202,
+            "message": "Archival started",
+            "job": job_serializer(job)
+        }, status_code=202, headers={"Location": f"/api/jobs/{job['_id']}"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting archival: {str(e)}")
+
 @router.get("/")
 async def get_all_incidents(
     status: Optional[str] = Query(None, description="Filter by status"),
-    severity: Optional[str] = Query(None, description="Filter by severity")
+    severity: Optional[str] = Query(None, description="Filter by severity"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of incidents to return"),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    stream: bool = Query(False, description="Stream all matching incidents as NDJSON"),
+    count: str = Query("exact", pattern="^(exact|estimated|none)$", description="How to count all matching incidents: exact, estimated, or none to skip the count")
 ):
-    """Fetch all incidents with optional filters"""
+    """Fetch incidents newest first with optional filters and cursor pagination"""
     try:
         query = {}
         if status:
@@ -40,65 +183,159 @@ async def get_all_incidents(
         if severity:
             query["severity"] = severity
         
-        incidents = incidents_collection.find(query)
-        return {
+        try:
+            after_key = decode_cursor(after) if after else None
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+        
+        if stream:
+            cursor = repository.iter_incidents(query, after_key, limit)
+            return StreamingResponse(_stream_incidents(cursor), media_type="application/x-ndjson")
+        
+        page_size = limit or DEFAULT_PAGE_SIZE
+        # Fetch one extra document to learn whether another page exists
+        incidents = await repository.find_incidents(query, after_key, page_size + 1)
+        has_more = len(incidents) > page_size
+        incidents = incidents[:page_size]
+        
+        response = {
             "status_code": 200,
-            "count": incidents_collection.count_documents(query),
+            # count stays the total of all matching incidents, as before pagination
+            "count": None if count == "none" else await repository.count_incidents(query, estimated=count == "estimated"),
+            "next_cursor": encode_cursor(incidents[-1]) if has_more else None,
             "data": incidents_serializer(incidents)
         }
+        # Returned directly so orjson encodes the datetimes without a jsonable_encoder pass
+        return ORJSONResponse(response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching incidents: {str(e)}")
+
+async def _stream_incidents(cursor):
+    """Serialize incidents one line at a time as the cursor yields them"""
+    async for incident in cursor:
+        yield orjson.dumps(incident_serializer(incident)) + b"\n"
+
+@router.get("/batch")
+async def get_incidents_batch(
+    ids: List[str] = Query(..., description="Incident IDs, comma-separated or repeated")
+):
+    """Fetch several incidents by ID with a single query"""
+    try:
+        incident_ids = _split_ids(ids)
+        if len(incident_ids) > MAX_BULK_INCIDENTS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_INCIDENTS} incidents per request")
+        invalid_ids = [incident_id for incident_id in incident_ids if not ObjectId.is_valid(incident_id)]
+        if invalid_ids:
+            raise HTTPException(status_code=400, detail=f"Invalid incident ID format: {', '.join(invalid_ids)}")
+        
+        incidents = {str(incident["_id"]): incident for incident in await repository.find_incidents_by_ids(incident_ids)}
+        found = [incidents[incident_id] for incident_id in incident_ids if incident_id in incidents]
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "count": len(found),
+            "not_found": [incident_id for incident_id in incident_ids if incident_id not in incidents],
+            "data": incidents_serializer(found)
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching incidents: {str(e)}")
 
 @router.get("/{incident_id}")
-async def get_incident(incident_id: str):
+async def get_incident(
+    incident_id: str,
+    since: Optional[datetime] = Query(None, description="Return 304 unless the incident changed after this time"),
+    if_none_match: Optional[str] = Header(None)
+):
     """Fetch a specific incident by ID"""
     try:
         if not ObjectId.is_valid(incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
+        incident = await repository.find_incident(incident_id)
         if not incident:
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        return {
+        # The summary changes with the timeline without touching the incident's updated_at
+        summary = incident.get("summary") or {}
+        changed_at = max(version_of(incident.get("updated_at")), version_of(summary.get("updated_at")))
+        etag = incident_etag(incident)
+        if etag_matches(if_none_match, etag) or (since and changed_at <= version_of(since)):
+            return not_modified(etag)
+        
+        return ORJSONResponse({
             "status_code": 200,
             "data": incident_serializer(incident)
-        }
+        }, headers={"ETag": etag})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching incident: {str(e)}")
 
 @router.put("/{incident_id}")
-async def update_incident(incident_id: str, updated_incident: Incident):
+async def update_incident(incident_id: str, updated_incident: Incident, if_match: Optional[str] = Header(None)):
     """Update an existing incident"""
     try:
         if not ObjectId.is_valid(incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
-        
-        existing_incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
-        if not existing_incident:
-            raise HTTPException(status_code=404, detail="Incident not found")
+        expected = expected_version(incident_id, if_match)
         
         update_dict = updated_incident.dict(exclude_unset=True)
         update_dict["updated_at"] = datetime.now()
         
-        # If status is changed to Resolved or Closed, set resolved_at
-        if updated_incident.status in [IncidentStatus.RESOLVED, IncidentStatus.CLOSED]:
-            if not existing_incident.get("resolved_at"):
-                update_dict["resolved_at"] = datetime.now()
+        # Run the update as a pipeline so the resolved_at rule is evaluated on the
+        # server; $literal keeps user-supplied strings from being read as field paths
+        set_stage = {field: {"$literal": value} for field, value in update_dict.items()}
         
-        incidents_collection.update_one(
-            {"_id": ObjectId(incident_id)},
-            {"$set": update_dict}
-        )
+        # If status is changed to Resolved or Closed, set resolved_at unless already set
+        set_stage.update(_resolved_at_rule(updated_incident.status, datetime.now()))
         
-        updated = incidents_collection.find_one({"_id": ObjectId(incident_id)})
-        return {
+        updated = await _conditional_update(incident_id, set_stage, expected)
+        
+        return ORJSONResponse({
             "status_code": 200,
             "message": "Incident updated successfully",
             "data": incident_serializer(updated)
-        }
+        }, headers={"ETag": incident_etag(updated)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating incident: {str(e)}")
+
+@router.patch("/{incident_id}")
+async def patch_incident(incident_id: str, changes: IncidentUpdate, if_match: Optional[str] = Header(None)):
+    """Update only the given fields of an incident
+    
+    Send the version last read, in the body or as an If-Match ETag, to have the
+    update rejected with 412 if the incident changed in the meantime. The check
+    and the write are a single conditional update, with no read beforehand.
+    """
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        expected = expected_version(incident_id, if_match, changes.version)
+        
+        update_dict = changes.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+        if not update_dict:
+            raise HTTPException(status_code=400, detail="No fields to update")
+        now = datetime.now()
+        
+        set_stage = {field: {"$literal": value} for field, value in update_dict.items()}
+        set_stage["updated_at"] = now
+        # An explicit resolved_at wins over the rule
+        if "status" in update_dict and "resolved_at" not in update_dict:
+            set_stage.update(_resolved_at_rule(update_dict["status"], now))
+        
+        updated = await _conditional_update(incident_id, set_stage, expected)
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "message": "Incident updated successfully",
+            "data": incident_serializer(updated)
+        }, headers={"ETag": incident_etag(updated)})
     except HTTPException:
         raise
     except Exception as e:
@@ -106,19 +343,42 @@ async def update_incident(incident_id: str, updated_incident: Incident):
 
 @router.delete("/{incident_id}")
 async def delete_incident(incident_id: str):
-    """Delete an incident"""
+    """Delete an incident along with its timeline and postmortem"""
     try:
         if not ObjectId.is_valid(incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
-        result = incidents_collection.delete_one({"_id": ObjectId(incident_id)})
-        if result.deleted_count == 0:
+        event_count = await repository.count_timeline_events(incident_id, limit=CASCADE_SYNC_LIMIT + 1)
+        if event_count <= CASCADE_SYNC_LIMIT:
+            deleted = await repository.delete_incident(incident_id)
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Incident not found")
+            
+            return {
+                "status_code": 200,
+                "message": "Incident deleted successfully",
+                "deleted": deleted
+            }
+        
+        # Too many events to delete within the request. The job is recorded before
+        # the incident goes, so its events are removed even if this worker dies;
+        # events orphaned by an earlier delete are cleaned up the same way.
+        job = await job_service.create_job(
+            "delete_timeline",
+            {"incident_id": incident_id},
+            total=await repository.count_timeline_events(incident_id)
+        )
+        deleted = await repository.delete_incident(incident_id, cascade_timeline=False)
+        job_service.start_job(job["_id"])
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        return {
-            "status_code": 200,
-            "message": "Incident deleted successfully"
-        }
+        return ORJSONResponse({
+            "status_code": 202,
+            "message": "Incident deleted successfully; its timeline is being deleted in the background",
+            "deleted": deleted,
+            "job": job_serializer(job)
+        }, status_code=202, headers={"Location": f"/api/jobs/{job['_id']}"})
     except HTTPException:
         raise
     except Exception as e:
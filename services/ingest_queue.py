@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from config import INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL_MS
+from database import repository
+from middleware.metrics import ingest_flush_duration, ingest_batch_size
+from services import timeline_stream
+
+logger = logging.getLogger(__name__)
+
+# Write-behind ingestion for timeline events posted with ?async=true. Accepted
+# events wait in a bounded in-process queue and a single background task writes
+# them with insert_many, flushing when a batch fills up or the flush interval
+# passes. Each event gets its _id and timestamp when it is accepted, so the
+# timeline order, which is by (timestamp, _id), is the acceptance order no
+# matter how the events are batched, and a retried insert can't duplicate one.
+
+FLUSH_RETRIES = 3
+
+class IngestQueue:
+    """Bounded queue of accepted timeline events and the task that flushes it"""
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._queue = None
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, event: dict) -> bool:
+        """Accept an event for writing, or return False if the queue is full or closing"""
+        if self._queue is None or self._closing:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def join(self):
+        """Wait until every accepted event has been written or given up on"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def drain(self):
+        """Stop accepting events, write everything still queued and stop the flusher"""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Dropped %d timeline events after repeated flush failures", len(batch))
+                self.failed += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list):
+        start = time.perf_counter()
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                errors = await repository.insert_timeline_events(batch)
+                break
+            except Exception as e:
+                if attempt == FLUSH_RETRIES - 1:
+                    raise
+                logger.warning("Timeline flush failed, retrying: %s", e)
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        # A duplicate key means an earlier attempt already wrote the event
+        failed = {index for index, message in errors.items() if not message.startswith("E11000")}
+        for index in failed:
+            logger.error("Could not write queued timeline event: %s", errors[index])
+        inserted = [event for index, event in enumerate(batch) if index not in failed]
+        if inserted:
+            await self._after_insert(inserted)
+
+        elapsed = time.perf_counter() - start
+        self.written += len(inserted)
+        self.failed += len(failed)
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        ingest_flush_duration.observe((), elapsed)
+        ingest_batch_size.observe((), len(batch))
+
+    async def _after_insert(self, inserted: list):
+        """Update summaries and notify streams for written events
+        
+        The events are already stored, so a failure here is logged rather than
+        counting them as dropped.
+        """
+        try:
+            await repository.record_timeline_inserts(inserted)
+        except Exception:
+            logger.exception(
+                "Wrote %d timeline events but could not update incident summaries; "
+                "python -m database.backfill rebuilds them", len(inserted)
+            )
+        for event in inserted:
+            try:
+                timeline_stream.notify(event["incident_id"], "insert", event)
+            except Exception:
+                logger.exception("Could not notify streams of timeline event %s", event["_id"])
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "max_size": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 1),
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 1)
+        }
+
+ingest_queue = IngestQueue(INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL_MS / 1000)
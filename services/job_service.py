@@ -0,0 +1,253 @@
+import asyncio
+import gzip
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import json_util
+from bson.objectid import ObjectId
+from fastapi import APIRouter, HTTPException, Query
+from config import ARCHIVE_DIR
+from database import repository
+from database.schemas import job_serializer
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Maintenance work too slow for a request runs as a job: a document in the jobs
+# collection records its parameters and progress, and the worker that created
+# it runs it as a background task. The runner holds a lease on the job that it
+# renews with every batch; if the worker dies the lease lapses and the job is
+# picked up again when a worker starts. Every step is idempotent, so resuming
+# a job partway through is safe.
+
+LEASE_SECONDS = 60
+# Long batches renew the lease this often, well before it can lapse
+HEARTBEAT_SECONDS = 10
+DELETE_BATCH_SIZE = 5000
+ARCHIVE_BATCH_SIZE = 100
+ARCHIVE_TIMELINE_BATCH_SIZE = 1000
+WORKER_ID = uuid.uuid4().hex[:8]
+
+# Strong references to running tasks; the event loop only keeps weak ones
+_tasks = set()
+
+class LeaseLost(Exception):
+    """Another worker took over the job after this worker's lease expired"""
+
+class JobProgress:
+    """Records a job's progress and renews its lease"""
+
+    def __init__(self, job: dict):
+        self.job_id = job["_id"]
+        self.processed = job.get("processed", 0)
+        self.renewed_at = datetime.now()
+
+    async def _update(self, fields: dict):
+        if not await repository.update_job(self.job_id, WORKER_ID, {"updated_at": datetime.now(), **fields}):
+            raise LeaseLost()
+
+    async def advance(self, amount: int):
+        self.processed += amount
+        self.renewed_at = datetime.now()
+        lease_until = self.renewed_at + timedelta(seconds=LEASE_SECONDS)
+        await self._update({"processed": self.processed, "lease_until": lease_until})
+
+    async def heartbeat(self):
+        """Renew the lease without recording progress, if it hasn't been renewed lately"""
+        now = datetime.now()
+        if now - self.renewed_at < timedelta(seconds=HEARTBEAT_SECONDS):
+            return
+        self.renewed_at = now
+        await self._update({"lease_until": now + timedelta(seconds=LEASE_SECONDS)})
+
+    async def finish(self, status: str, error: Optional[str] = None):
+        await self._update({"status": status, "error": error, "lease_until": None, "finished_at": datetime.now()})
+
+async def create_job(job_type: str, params: dict, total: Optional[int] = None) -> dict:
+    """Record a new pending job; call start_job to run it"""
+    now = datetime.now()
+    job = {
+        "type": job_type,
+        "params": params,
+        "status": "pending",
+        "processed": 0,
+        "total": total,
+        "error": None,
+        "owner": None,
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None
+    }
+    result = await repository.insert_job(job)
+    job["_id"] = result.inserted_id
+    return job
+
+def start_job(job_id):
+    task = asyncio.create_task(run_job(job_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def run_job(job_id):
+    """Claim a job and run it to completion"""
+    now = datetime.now()
+    job = await repository.claim_job(job_id, WORKER_ID, now + timedelta(seconds=LEASE_SECONDS), now)
+    if job is None:
+        # Already finished, or another worker holds it
+        return
+    progress = JobProgress(job)
+    try:
+        await JOB_HANDLERS[job["type"]](job, progress)
+        await progress.finish("completed")
+    except LeaseLost:
+        logger.warning("Lost the lease on job %s; another worker resumed it", job_id)
+    except asyncio.CancelledError:
+        # Shutting down: the lease lapses and the job is resumed by the next worker to start
+        raise
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        try:
+            await progress.finish("failed", str(e))
+        except LeaseLost:
+            pass
+
+async def resume_jobs():
+    """Start every unfinished job whose lease has lapsed"""
+    for job_id in await repository.find_resumable_job_ids(datetime.now()):
+        start_job(job_id)
+
+async def stop_jobs():
+    """Cancel this worker's running jobs; their leases lapse and they resume elsewhere"""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# Job types
+async def delete_timeline(job: dict, progress: JobProgress):
+    """Delete a deleted incident's timeline in batches"""
+    incident_id = job["params"]["incident_id"]
+    while True:
+        deleted = await repository.delete_timeline_batch(incident_id, DELETE_BATCH_SIZE)
+        if not deleted:
+            break
+        await progress.advance(deleted)
+
+def _append_archive(path: str, records: list):
+    """Append JSON lines to a gzip file"""
+    # An empty ARCHIVE_DIR means the working directory, which needs no creating
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Each append adds a gzip member; readers see them as one continuous stream
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for record in records:
+            archive.write(json_util.dumps(record) + "\n")
+
+async def _archive_to_file(path: str, incidents: list, postmortems: list, revisions: list, progress: JobProgress):
+    """Write each incident to the archive file, followed by its timeline
+    
+    An incident's line holds the incident, its postmortem and its postmortem
+    revisions. Its timeline follows in lines of {"incident_id", "timeline"},
+    at most ARCHIVE_TIMELINE_BATCH_SIZE events each, so a long timeline is
+    never held in memory at once.
+    """
+    postmortem_by_incident = {postmortem["incident_id"]: postmortem for postmortem in postmortems}
+    revisions_by_incident = {}
+    for revision in revisions:
+        revisions_by_incident.setdefault(revision["incident_id"], []).append(revision)
+    
+    for incident in incidents:
+        incident_id = str(incident["_id"])
+        record = {
+            "incident": incident,
+            "postmortem": postmortem_by_incident.get(incident_id),
+            "postmortem_revisions": sorted(revisions_by_incident.get(incident_id, []), key=lambda revision: revision["revision"])
+        }
+        await asyncio.to_thread(_append_archive, path, [record])
+        async for events in repository.iter_timeline_batches(incident_id, ARCHIVE_TIMELINE_BATCH_SIZE):
+            await asyncio.to_thread(_append_archive, path, [{"incident_id": incident_id, "timeline": events}])
+            await progress.heartbeat()
+        await progress.heartbeat()
+
+async def archive_incidents(job: dict, progress: JobProgress):
+    """Move closed incidents older than the cutoff, with their timelines and postmortems, out of the hot collections"""
+    params = job["params"]
+    while True:
+        incidents, postmortems, revisions = await repository.find_archivable_incidents(
+            params["cutoff"], ARCHIVE_BATCH_SIZE
+        )
+        if not incidents:
+            break
+        incident_ids = [str(incident["_id"]) for incident in incidents]
+        if params["target"] == "collection":
+            # Timelines are copied a batch at a time, so memory use doesn't grow with
+            # their length; the lease is kept alive however long the batch takes
+            for incident_id in incident_ids:
+                async for events in repository.iter_timeline_batches(incident_id, ARCHIVE_TIMELINE_BATCH_SIZE):
+                    await repository.copy_timeline_to_archive(events)
+                    await progress.heartbeat()
+                await progress.heartbeat()
+            await repository.copy_to_archive(incidents, postmortems, revisions)
+        else:
+            # A batch interrupted after this write is archived again on resume,
+            # so a file may hold an incident twice but never lose one
+            await _archive_to_file(params["path"], incidents, postmortems, revisions, progress)
+        await repository.delete_archived(incident_ids)
+        await progress.advance(len(incidents))
+
+JOB_HANDLERS = {
+    "delete_timeline": delete_timeline,
+    "archive_incidents": archive_incidents
+}
+
+async def start_archive(older_than_days: int, target: str) -> dict:
+    """Create and start a job archiving closed incidents resolved more than older_than_days ago"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    params = {"older_than_days": older_than_days, "cutoff": cutoff, "target": target}
+    if target == "file":
+        params["path"] = os.path.join(ARCHIVE_DIR, f"incidents-{cutoff:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz")
+    total = await repository.count_incidents(repository.archivable_query(cutoff))
+    job = await create_job("archive_incidents", params, total)
+    start_job(job["_id"])
+    return job
+
+# Job endpoints
+@router.get("/")
+async def get_jobs(
+    status: Optional[str] = Query(None, pattern="^(pending|running|completed|failed)$", description="Filter by status"),
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of jobs to return")
+):
+    """List jobs, newest first"""
+    try:
+        jobs = await repository.find_jobs(status, limit)
+        return {
+            "status_code": 200,
+            "count": len(jobs),
+            "data": [job_serializer(job) for job in jobs]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Fetch a job's status and progress"""
+    try:
+        if not ObjectId.is_valid(job_id):
+            raise HTTPException(status_code=400, detail="Invalid job ID format")
+        
+        job = await repository.find_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
+        return {
+            "status_code": 200,
+            "data": job_serializer(job)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job: {str(e)}")
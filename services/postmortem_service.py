@@ -1,13 +1,49 @@
-from fastapi import APIRouter, HTTPException
-from config import postmortem_collection, incidents_collection, timeline_collection
-from database.schemas import postmortem_serializer, incident_serializer, timeline_events_serializer
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from database import repository
+from database.schemas import postmortem_revision_serializer, postmortem_serializer, report_serializer
+from database.revisions import rebuild
 from database.models import Postmortem
 from bson.objectid import ObjectId
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import csv
+import io
+import zlib
+import orjson
 
 router = APIRouter()
 
+# Values for fields a write doesn't touch when it creates the postmortem
+POSTMORTEM_DEFAULTS = {
+    "root_cause": "",
+    "contributing_factors": [],
+    "impact": "",
+    "action_items": []
+}
+
+def _upsert_update(now: datetime, set_fields: dict, add_to_set: dict = None) -> dict:
+    """Build an upsert update that only fills in defaults for untouched fields on insert"""
+    touched = set(set_fields) | set(add_to_set or {})
+    on_insert = {field: value for field, value in POSTMORTEM_DEFAULTS.items() if field not in touched}
+    on_insert["created_at"] = now
+    
+    update = {"$set": {**set_fields, "updated_at": now}, "$setOnInsert": on_insert}
+    if add_to_set:
+        update["$addToSet"] = {field: {"$each": values} for field, values in add_to_set.items()}
+    return update
+
+def _was_created(postmortem) -> bool:
+    # created_at and updated_at are written with the same value only on insert
+    return postmortem.get("created_at") == postmortem.get("updated_at")
+
+async def _save_postmortem(incident_id: str, update: dict):
+    """Upsert the postmortem and flag the incident's summary when this created it"""
+    postmortem = await repository.upsert_postmortem(incident_id, update)
+    if _was_created(postmortem):
+        await repository.mark_has_postmortem(incident_id)
+    return postmortem
+
 @router.post("/{incident_id}/rca", status_code=201)
 async def generate_rca(incident_id: str, root_cause: str):
     """Generate or update Root Cause Analysis for an incident"""
@@ -16,46 +52,24 @@ async def generate_rca(incident_id: str, root_cause: str):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
         # Verify incident exists
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
-        if not incident:
+        if not await repository.incident_exists(incident_id):
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        # Check if postmortem already exists
-        existing_postmortem = postmortem_collection.find_one({"incident_id": incident_id})
-        
-        if existing_postmortem:
-            # Update existing postmortem
-            postmortem_collection.update_one(
-                {"incident_id": incident_id},
-                {"$set": {
-                    "root_cause": root_cause,
-                    "updated_at": datetime.now()
-                }}
-            )
-            updated = postmortem_collection.find_one({"incident_id": incident_id})
-            return {
-                "status_code": 200,
-                "message": "RCA updated successfully",
-                "data": postmortem_serializer(updated)
-            }
-        else:
-            # Create new postmortem
-            postmortem_dict = {
-                "incident_id": incident_id,
-                "root_cause": root_cause,
-                "contributing_factors": [],
-                "impact": "",
-                "action_items": [],
-                "created_at": datetime.now(),
-                "updated_at": datetime.now()
-            }
-            result = postmortem_collection.insert_one(postmortem_dict)
-            created = postmortem_collection.find_one({"_id": result.inserted_id})
+        postmortem = await _save_postmortem(
+            incident_id,
+            _upsert_update(datetime.now(), {"root_cause": root_cause})
+        )
+        if _was_created(postmortem):
             return {
                 "status_code": 201,
                 "message": "RCA created successfully",
-                "data": postmortem_serializer(created)
+                "data": postmortem_serializer(postmortem)
             }
+        return {
+            "status_code": 200,
+            "message": "RCA updated successfully",
+            "data": postmortem_serializer(postmortem)
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -69,54 +83,155 @@ async def add_contributing_factors(incident_id: str, factors: List[str]):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
         # Verify incident exists
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
-        if not incident:
+        if not await repository.incident_exists(incident_id):
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        # Check if postmortem exists
-        existing_postmortem = postmortem_collection.find_one({"incident_id": incident_id})
-        
-        if not existing_postmortem:
-            # Create new postmortem with factors
-            postmortem_dict = {
-                "incident_id": incident_id,
-                "root_cause": "",
-                "contributing_factors": factors,
-                "impact": "",
-                "action_items": [],
-                "created_at": datetime.now(),
-                "updated_at": datetime.now()
-            }
-            result = postmortem_collection.insert_one(postmortem_dict)
-            created = postmortem_collection.find_one({"_id": result.inserted_id})
+        # $addToSet dedupes on the server, so concurrent responders never overwrite each other
+        postmortem = await _save_postmortem(
+            incident_id,
+            _upsert_update(datetime.now(), {}, add_to_set={"contributing_factors": factors})
+        )
+        if _was_created(postmortem):
             return {
                 "status_code": 201,
                 "message": "Contributing factors added successfully",
-                "data": postmortem_serializer(created)
-            }
-        else:
-            # Add to existing factors
-            current_factors = existing_postmortem.get("contributing_factors", [])
-            updated_factors = list(set(current_factors + factors))  # Remove duplicates
-            
-            postmortem_collection.update_one(
-                {"incident_id": incident_id},
-                {"$set": {
-                    "contributing_factors": updated_factors,
-                    "updated_at": datetime.now()
-                }}
-            )
-            updated = postmortem_collection.find_one({"incident_id": incident_id})
-            return {
-                "status_code": 200,
-                "message": "Contributing factors updated successfully",
-                "data": postmortem_serializer(updated)
+                "data": postmortem_serializer(postmortem)
             }
+        return {
+            "status_code": 200,
+            "message": "Contributing factors updated successfully",
+            "data": postmortem_serializer(postmortem)
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding contributing factors: {str(e)}")
 
+# Bulk export
+EXPORT_MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "md": "text/markdown; charset=utf-8"
+}
+CSV_COLUMNS = [
+    "incident_id", "title", "severity", "status", "created_at", "resolved_at", "event_count",
+    "root_cause", "contributing_factors", "impact", "action_items", "postmortem_updated_at"
+]
+
+def _csv_row(values: list) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue().encode()
+
+def _isoformat(value) -> str:
+    return value.isoformat() if value else ""
+
+def _csv_report(report: dict) -> bytes:
+    incident, postmortem = report["incident"], report["postmortem"]
+    # The export skips the timeline lookups for CSV and takes the count from the incident summary
+    summary = incident.get("summary") or {}
+    return _csv_row([
+        str(incident["_id"]), incident["title"], incident["severity"], incident["status"],
+        _isoformat(incident.get("created_at")), _isoformat(incident.get("resolved_at")), summary.get("event_count", ""),
+        postmortem.get("root_cause", ""), "; ".join(postmortem.get("contributing_factors", [])),
+        postmortem.get("impact", ""), "; ".join(postmortem.get("action_items", [])),
+        _isoformat(postmortem.get("updated_at"))
+    ])
+
+def _markdown_report(report: dict) -> bytes:
+    incident, postmortem = report["incident"], report["postmortem"]
+    lines = [
+        f"## {incident['title']}",
+        "",
+        f"- **Incident:** {incident['id']}",
+        f"- **Severity:** {incident['severity']}",
+        f"- **Status:** {incident['status']}",
+        f"- **Created:** {_isoformat(incident['created_at'])}",
+        f"- **Resolved:** {_isoformat(incident['resolved_at']) or 'unresolved'}",
+        "",
+        "### Root cause",
+        "",
+        postmortem["root_cause"] or "_Not recorded_",
+        "",
+        "### Contributing factors",
+        "",
+        *([f"- {factor}" for factor in postmortem["contributing_factors"]] or ["_None recorded_"]),
+        "",
+        "### Impact",
+        "",
+        postmortem["impact"] or "_Not recorded_",
+        "",
+        "### Action items",
+        "",
+        *([f"- [ ] {item}" for item in postmortem["action_items"]] or ["_None recorded_"]),
+        "",
+        f"### Timeline ({len(report['timeline'])} of {report['timeline_count']} events)",
+        ""
+    ]
+    for event in report["timeline"]:
+        description = f" {event['description']}" if "description" in event else ""
+        lines.append(f"- `{_isoformat(event['timestamp'])}` **{event['event_type']}**{description}")
+    lines += ["", "---", "", ""]
+    return "\n".join(lines).encode()
+
+async def _export_chunks(reports, export_format: str, summary: bool):
+    """Encode reports one at a time as the cursor yields them"""
+    if export_format == "csv":
+        yield _csv_row(CSV_COLUMNS)
+    elif export_format == "md":
+        yield b"# Postmortems\n\n"
+    async for report in reports:
+        if export_format == "csv":
+            yield _csv_report(report)
+        elif export_format == "md":
+            yield _markdown_report(report_serializer(report, summary=summary))
+        else:
+            yield orjson.dumps(report_serializer(report, summary=summary)) + b"\n"
+
+async def _gzip_chunks(chunks):
+    # wbits=31 writes a gzip header, as Content-Encoding: gzip expects
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@router.get("/export")
+async def export_postmortems(
+    start: Optional[datetime] = Query(None, alias="from", description="Only incidents created at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only incidents created before this time"),
+    export_format: str = Query("jsonl", alias="format", pattern="^(jsonl|csv|md)$", description="jsonl, csv or md"),
+    timeline_limit: Optional[int] = Query(None, ge=1, description="Only include the most recent N timeline events"),
+    timeline_fields: str = Query("full", pattern="^(full|summary)$", description="full or summary timeline events"),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """Stream the postmortem reports of incidents created in a date range, read-only
+    
+    Reports are streamed from a single aggregation cursor as they arrive, so
+    exports of thousands of incidents run in constant memory. Responses are
+    gzip-compressed when the client accepts it.
+    """
+    try:
+        if start and end and start >= end:
+            raise HTTPException(status_code=400, detail="'from' must be earlier than 'to'")
+        
+        summary = timeline_fields == "summary"
+        reports = repository.iter_reports(
+            start, end, timeline_limit, summary, include_timeline=export_format != "csv"
+        )
+        chunks = _export_chunks(reports, export_format, summary)
+        headers = {"Content-Disposition": f'attachment; filename="postmortems.{export_format}"', "Vary": "Accept-Encoding"}
+        if accept_encoding and "gzip" in accept_encoding.lower():
+            chunks = _gzip_chunks(chunks)
+            headers["Content-Encoding"] = "gzip"
+        
+        return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting postmortems: {str(e)}")
+
 @router.get("/{incident_id}")
 async def get_postmortem(incident_id: str):
     """Fetch postmortem report for an incident"""
@@ -125,11 +240,11 @@ async def get_postmortem(incident_id: str):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
         # Verify incident exists
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
+        incident = await repository.find_incident(incident_id)
         if not incident:
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        postmortem = postmortem_collection.find_one({"incident_id": incident_id})
+        postmortem = await repository.find_postmortem(incident_id)
         if not postmortem:
             raise HTTPException(status_code=404, detail="Postmortem not found for this incident")
         
@@ -142,61 +257,117 @@ async def get_postmortem(incident_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching postmortem: {str(e)}")
 
+@router.get("/{incident_id}/revisions")
+async def get_postmortem_revisions(
+    incident_id: str,
+    after: int = Query(0, ge=0, description="Only list revisions after this one"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of revisions to return")
+):
+    """List the revisions of an incident's postmortem, oldest first"""
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        
+        revisions = await repository.find_postmortem_revisions(incident_id, after, limit)
+        if not revisions and after == 0:
+            raise HTTPException(status_code=404, detail="Postmortem not found for this incident")
+        
+        return {
+            "status_code": 200,
+            "data": [postmortem_revision_serializer(revision) for revision in revisions],
+            "next_after": revisions[-1]["revision"] if len(revisions) == limit else None
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching postmortem revisions: {str(e)}")
+
+@router.get("/{incident_id}/revisions/{revision}")
+async def get_postmortem_revision(incident_id: str, revision: int):
+    """Fetch the postmortem as it was at a revision"""
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        if revision < 1:
+            raise HTTPException(status_code=400, detail="Revision must be at least 1")
+        
+        revisions = await repository.find_revision_chain(incident_id, revision)
+        if not revisions or revisions[-1]["revision"] != revision:
+            raise HTTPException(status_code=404, detail="Postmortem revision not found")
+        
+        # Without transactions, concurrent writers can record revisions out of order
+        state = rebuild(revisions, revision)
+        if state is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Postmortem revisions are still being recorded, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        
+        return {
+            "status_code": 200,
+            "data": {"incident_id": incident_id, "revision": revision, **state}
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching postmortem revision: {str(e)}")
+
+@router.get("/{incident_id}/report")
+async def get_postmortem_report(
+    incident_id: str,
+    timeline_limit: Optional[int] = Query(None, ge=1, description="Only include the most recent N timeline events"),
+    timeline_fields: str = Query("full", pattern="^(full|summary)$", description="full or summary timeline events")
+):
+    """Fetch the postmortem report (incident, timeline and postmortem) without modifying it"""
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        
+        report = await repository.find_report(incident_id, timeline_limit, timeline_fields == "summary")
+        if not report:
+            raise HTTPException(status_code=404, detail="Incident not found")
+        if not report["postmortem"]:
+            raise HTTPException(status_code=404, detail="Postmortem not found for this incident")
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "data": report_serializer(report, summary=timeline_fields == "summary")
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching postmortem report: {str(e)}")
+
 @router.post("/{incident_id}/generate")
-async def generate_final_postmortem(incident_id: str, impact: str, action_items: List[str]):
+async def generate_final_postmortem(
+    incident_id: str,
+    impact: str,
+    action_items: List[str],
+    timeline_limit: Optional[int] = Query(None, ge=1, description="Only include the most recent N timeline events"),
+    timeline_fields: str = Query("full", pattern="^(full|summary)$", description="full or summary timeline events")
+):
     """Generate final comprehensive postmortem report"""
     try:
         if not ObjectId.is_valid(incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
-        # Verify incident exists
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
-        if not incident:
+        # Fetch incident and timeline in one round trip; this also verifies the incident exists
+        report = await repository.find_report(incident_id, timeline_limit, timeline_fields == "summary")
+        if not report:
             raise HTTPException(status_code=404, detail="Incident not found")
         
-        # Get timeline events
-        timeline_events = list(timeline_collection.find({"incident_id": incident_id}).sort("timestamp", 1))
-        
-        # Check if postmortem exists
-        existing_postmortem = postmortem_collection.find_one({"incident_id": incident_id})
-        
-        if existing_postmortem:
-            # Update with final details
-            postmortem_collection.update_one(
-                {"incident_id": incident_id},
-                {"$set": {
-                    "impact": impact,
-                    "action_items": action_items,
-                    "updated_at": datetime.now()
-                }}
-            )
-            updated = postmortem_collection.find_one({"incident_id": incident_id})
-            postmortem_data = postmortem_serializer(updated)
-        else:
-            # Create complete postmortem
-            postmortem_dict = {
-                "incident_id": incident_id,
-                "root_cause": "",
-                "contributing_factors": [],
-                "impact": impact,
-                "action_items": action_items,
-                "created_at": datetime.now(),
-                "updated_at": datetime.now()
-            }
-            result = postmortem_collection.insert_one(postmortem_dict)
-            created = postmortem_collection.find_one({"_id": result.inserted_id})
-            postmortem_data = postmortem_serializer(created)
+        postmortem = await _save_postmortem(
+            incident_id,
+            _upsert_update(datetime.now(), {"impact": impact, "action_items": action_items})
+        )
         
         # Return comprehensive report
-        return {
+        return ORJSONResponse({
             "status_code": 200,
             "message": "Final postmortem report generated successfully",
-            "data": {
-                "incident": incident_serializer(incident),
-                "timeline": timeline_events_serializer(timeline_events),
-                "postmortem": postmortem_data
-            }
-        }
+            "data": report_serializer(report, postmortem, summary=timeline_fields == "summary")
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,118 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from database import repository
+from database.schemas import incident_serializer
+from bson.objectid import ObjectId
+import asyncio
+import html
+import re
+
+router = APIRouter()
+
+# Search runs one $text query per collection, each capped at MAX_CANDIDATES
+# best matches, so latency stays bounded however large the corpus grows. The
+# text indexes are maintained by MongoDB on every write the services make.
+MAX_CANDIDATES = 200
+SNIPPET_CONTEXT = 60
+
+def _highlighter(text: str):
+    """Regex matching words that start with any search term, e.g. 'timeout' in 'timeouts'"""
+    terms = [re.escape(term) for term in re.findall(r"\w+", text) if len(term) > 1]
+    return re.compile(r"\b(" + "|".join(terms) + r")\w*", re.IGNORECASE) if terms else None
+
+def _highlight(text: str, pattern) -> str:
+    """HTML-escape the text and wrap every match in <mark>; stored text is never trusted as markup"""
+    parts = []
+    last = 0
+    for match in pattern.finditer(text):
+        parts.append(html.escape(text[last:match.start()]))
+        parts.append("<mark>" + html.escape(match.group(0)) + "</mark>")
+        last = match.end()
+    parts.append(html.escape(text[last:]))
+    return "".join(parts)
+
+def _snippet(value: str, pattern) -> str:
+    """A window of escaped text around the first match, with every match wrapped in <mark>"""
+    match = pattern.search(value) if pattern else None
+    if not match:
+        return html.escape(value[:2 * SNIPPET_CONTEXT])
+    start = max(0, match.start() - SNIPPET_CONTEXT)
+    end = min(len(value), match.end() + SNIPPET_CONTEXT)
+    window = _highlight(value[start:end], pattern)
+    return ("..." if start > 0 else "") + window + ("..." if end < len(value) else "")
+
+@router.get("")
+async def search(
+    q: str = Query(..., min_length=2, description="Words or \"exact phrases\" to search for"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of incidents to return"),
+    offset: int = Query(0, ge=0, le=MAX_CANDIDATES, description="Number of ranked incidents to skip")
+):
+    """Search incidents, timeline descriptions and postmortems, ranked by relevance per incident"""
+    try:
+        incident_hits, timeline_hits, postmortem_hits = await asyncio.gather(
+            repository.search_incidents(q, MAX_CANDIDATES),
+            repository.search_timeline(q, MAX_CANDIDATES),
+            repository.search_postmortems(q, MAX_CANDIDATES)
+        )
+        pattern = _highlighter(q)
+        
+        # An incident scores for its own fields, its postmortem and its best timeline event
+        results = {}
+        def result_for(incident_id: str) -> dict:
+            return results.setdefault(incident_id, {"score": 0.0, "timeline_score": 0.0, "matches": []})
+        
+        for incident in incident_hits:
+            result = result_for(str(incident["_id"]))
+            result["incident"] = incident
+            result["score"] += incident["score"]
+            for field in ("title", "description"):
+                if pattern and pattern.search(incident[field]):
+                    result["matches"].append({"source": f"incident.{field}", "snippet": _snippet(incident[field], pattern)})
+        # Timeline events and postmortems reference incidents by a string that was
+        # never guaranteed to be a valid ID; those can't be looked up, so skip them
+        for postmortem in postmortem_hits:
+            if not ObjectId.is_valid(postmortem["incident_id"]):
+                continue
+            result = result_for(postmortem["incident_id"])
+            result["score"] += postmortem["score"]
+            texts = [("postmortem.root_cause", postmortem.get("root_cause", ""))]
+            texts += [("postmortem.contributing_factors", factor) for factor in postmortem.get("contributing_factors", [])]
+            for source, value in texts:
+                if pattern and pattern.search(value):
+                    result["matches"].append({"source": source, "snippet": _snippet(value, pattern)})
+        for event in timeline_hits:
+            if not ObjectId.is_valid(event["incident_id"]):
+                continue
+            result = result_for(event["incident_id"])
+            result["timeline_score"] = max(result["timeline_score"], event["score"])
+            result["matches"].append({
+                "source": "timeline.description",
+                "event_id": str(event["_id"]),
+                "snippet": _snippet(event["description"], pattern)
+            })
+        
+        ranked = sorted(results.items(), key=lambda item: item[1]["score"] + item[1]["timeline_score"], reverse=True)
+        page = ranked[offset:offset + limit]
+        
+        # Fetch the incidents on this page that only matched through timeline or postmortem
+        missing = [incident_id for incident_id, result in page if "incident" not in result]
+        if missing:
+            for incident in await repository.find_incidents_by_ids(missing):
+                results[str(incident["_id"])]["incident"] = incident
+        
+        data = [{
+            "incident": incident_serializer(result["incident"]),
+            "score": round(result["score"] + result["timeline_score"], 3),
+            "matches": result["matches"]
+        } for incident_id, result in page if "incident" in result]
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "query": q,
+            "count": len(data),
+            "total": len(ranked),
+            "next_offset": offset + limit if offset + limit < len(ranked) else None,
+            "data": data
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching: {str(e)}")
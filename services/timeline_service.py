@@ -1,29 +1,71 @@
-from fastapi import APIRouter, HTTPException
-from config import timeline_collection, incidents_collection
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import ValidationError
+from database import repository
 from database.schemas import timeline_event_serializer, timeline_events_serializer
-from database.models import TimelineEvent
+from database.models import EventType, TimelineEvent, TimelineEventUpdate
+from services import timeline_stream
+from services.ingest_queue import ingest_queue
+from services.etags import make_etag, etag_matches, not_modified, expected_version, version_filter
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
+import math
+import orjson
 
 router = APIRouter()
 
+MAX_BULK_EVENTS = 5000
+
+# Timeline summaries: bucket suffixes as $dateTrunc units, and the event types
+# that are always returned whole rather than counted
+BUCKET_UNITS = {"s": ("second", 1), "m": ("minute", 60), "h": ("hour", 3600), "d": ("day", 86400)}
+KEY_EVENT_TYPES = [EventType.DETECTION.value, EventType.MITIGATION.value, EventType.RESOLUTION.value]
+MAX_SUMMARY_BUCKETS = 500
+# Widest bucket accepted or widened to, well inside the $dateTrunc binSize range
+MAX_BUCKET_SECONDS = 366 * 86400
+MAX_KEY_EVENTS = 1000
+SUMMARY_SAMPLES = 3
+
 @router.post("/", status_code=201)
-async def add_timeline_event(event: TimelineEvent):
-    """Add a timeline event to an incident"""
+async def add_timeline_event(
+    event: TimelineEvent,
+    write_behind: bool = Query(False, alias="async", description="Accept with 202 and write the event in a background batch")
+):
+    """Add a timeline event to an incident
+    
+    With async=true the event is validated, given its ID and timestamp, and
+    queued; it is written within the flush interval. A full queue answers 429.
+    """
     try:
         # Verify incident exists
         if not ObjectId.is_valid(event.incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
-        incident = incidents_collection.find_one({"_id": ObjectId(event.incident_id)})
-        if not incident:
+        if not await repository.incident_exists(event.incident_id):
             raise HTTPException(status_code=404, detail="Incident not found")
         
         event_dict = event.dict()
         event_dict["timestamp"] = datetime.now()
         
-        result = timeline_collection.insert_one(event_dict)
-        created_event = timeline_collection.find_one({"_id": result.inserted_id})
+        if write_behind:
+            event_dict["_id"] = ObjectId()
+            if not ingest_queue.put(event_dict):
+                raise HTTPException(
+                    status_code=429,
+                    detail="Timeline ingestion queue is full, retry later",
+                    headers={"Retry-After": "1"}
+                )
+            return ORJSONResponse({
+                "status_code": 202,
+                "message": "Timeline event accepted",
+                "data": timeline_event_serializer(event_dict)
+            }, status_code=202)
+        
+        result = await repository.insert_timeline_event(event_dict)
+        created_event = {**event_dict, "_id": result.inserted_id}
+        await repository.record_timeline_inserts([created_event])
+        timeline_stream.notify(event.incident_id, "insert", created_event)
         
         return {
             "status_code": 201,
@@ -35,33 +77,237 @@ async def add_timeline_event(event: TimelineEvent):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding timeline event: {str(e)}")
 
+@router.post("/bulk")
+async def add_timeline_events_bulk(request: Request):
+    """Add many timeline events, possibly for several incidents, in one request
+    
+    Accepts a JSON array of events, or one event per line when sent as
+    application/x-ndjson. Events keep their own timestamp if one is given, since
+    a batch is usually delivered some time after the events happened.
+    """
+    try:
+        body = await request.body()
+        try:
+            if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+                items = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                items = orjson.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected an array of timeline events")
+        if len(items) > MAX_BULK_EVENTS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_EVENTS} events per request")
+        
+        results = [None] * len(items)
+        events = {}
+        for index, item in enumerate(items):
+            try:
+                event = TimelineEvent.model_validate(item)
+            except ValidationError as e:
+                errors = e.errors(include_url=False, include_context=False)
+                results[index] = {"index": index, "status": "error", "detail": errors}
+                continue
+            if not ObjectId.is_valid(event.incident_id):
+                results[index] = {"index": index, "status": "error", "detail": "Invalid incident ID format"}
+                continue
+            events[index] = event
+        
+        # Verify every referenced incident exists with one $in query
+        existing_ids = await repository.find_existing_incident_ids(
+            list({event.incident_id for event in events.values()})
+        )
+        
+        now = datetime.now()
+        indexes, documents = [], []
+        for index, event in events.items():
+            if event.incident_id not in existing_ids:
+                results[index] = {"index": index, "status": "error", "detail": "Incident not found"}
+                continue
+            event_dict = event.dict()
+            event_dict["timestamp"] = event_dict["timestamp"] or now
+            indexes.append(index)
+            documents.append(event_dict)
+        
+        errors = await repository.insert_timeline_events(documents)
+        for position, (index, document) in enumerate(zip(indexes, documents)):
+            if position in errors:
+                results[index] = {"index": index, "status": "error", "detail": errors[position]}
+            else:
+                results[index] = {"index": index, "status": "created", "data": timeline_event_serializer(document)}
+                timeline_stream.notify(document["incident_id"], "insert", document)
+        
+        inserted = [document for position, document in enumerate(documents) if position not in errors]
+        if inserted:
+            await repository.record_timeline_inserts(inserted)
+        
+        created = sum(1 for result in results if result["status"] == "created")
+        return {
+            "status_code": 200,
+            "message": f"{created} of {len(items)} timeline events added",
+            "created": created,
+            "failed": len(items) - created,
+            "data": results
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding timeline events: {str(e)}")
+
 @router.get("/{incident_id}")
-async def get_timeline(incident_id: str):
-    """Fetch all timeline events for an incident (sorted chronologically)"""
+async def get_timeline(
+    incident_id: str,
+    since: Optional[str] = Query(None, description="Only events after this timestamp or event ID"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Fetch timeline events for an incident (sorted chronologically)
+    
+    Responses carry a strong ETag derived from the incident's timeline version,
+    so an unchanged poll with If-None-Match costs one indexed lookup and gets 304.
+    """
     try:
         if not ObjectId.is_valid(incident_id):
             raise HTTPException(status_code=400, detail="Invalid incident ID format")
         
-        # Verify incident exists
-        incident = incidents_collection.find_one({"_id": ObjectId(incident_id)})
+        # Verify incident exists. The version is read before the events, so a write
+        # landing in between can only make the ETag older than the body, never newer
+        incident = await repository.find_timeline_version(incident_id)
         if not incident:
             raise HTTPException(status_code=404, detail="Incident not found")
         
+        etag_parts = [incident_id, incident.get("timeline_version", 0)]
+        after = None
+        if since:
+            after = await _parse_since(incident_id, since)
+            etag_parts.append(since)
+        etag = make_etag(*etag_parts)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
         # Fetch timeline events sorted by timestamp
-        events = timeline_collection.find({"incident_id": incident_id}).sort("timestamp", 1)
-        events_list = list(events)
+        events_list = await repository.find_timeline(incident_id, after)
         
-        return {
+        return ORJSONResponse({
             "status_code": 200,
             "incident_id": incident_id,
             "count": len(events_list),
+            "last_event_id": str(events_list[-1]["_id"]) if events_list else since,
             "data": timeline_events_serializer(events_list)
-        }
+        }, headers={"ETag": etag})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching timeline: {str(e)}")
 
+@router.get("/{incident_id}/summary")
+async def get_timeline_summary(
+    incident_id: str,
+    bucket: str = Query("5m", pattern=r"^[1-9][0-9]{0,7}[smhd]$", description="Bucket width up to 366 days, e.g. 30s, 5m, 1h or 1d"),
+    samples: int = Query(SUMMARY_SAMPLES, ge=1, le=20, description="Descriptions kept per bucket and event type"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Fetch a downsampled timeline: per-bucket counts by event type, with key events kept whole
+    
+    Detection, Mitigation and Resolution events are always returned verbatim.
+    The bucket is widened when needed so there are never more than
+    MAX_SUMMARY_BUCKETS buckets, however long the incident runs.
+    """
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        
+        incident = await repository.find_timeline_version(incident_id)
+        if not incident:
+            raise HTTPException(status_code=404, detail="Incident not found")
+        
+        etag = make_etag(incident_id, incident.get("timeline_version", 0), bucket, samples)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        unit, unit_seconds = BUCKET_UNITS[bucket[-1]]
+        bin_size = int(bucket[:-1])
+        max_bin_size = MAX_BUCKET_SECONDS // unit_seconds
+        if bin_size > max_bin_size:
+            raise HTTPException(status_code=400, detail=f"Bucket width must be at most {max_bin_size}{bucket[-1]}")
+        bounds = await repository.find_timeline_bounds(incident_id)
+        if bounds:
+            # One bucket is spare because buckets are aligned, not started at the first event
+            span = (bounds[1] - bounds[0]).total_seconds()
+            bin_size = min(max(bin_size, math.ceil(span / ((MAX_SUMMARY_BUCKETS - 1) * unit_seconds))), max_bin_size)
+        
+        summary = await repository.summarize_timeline(
+            incident_id, unit, bin_size, KEY_EVENT_TYPES, samples, MAX_SUMMARY_BUCKETS, MAX_KEY_EVENTS
+        )
+        width = timedelta(seconds=bin_size * unit_seconds)
+        for row in summary["buckets"]:
+            row["end"] = row["start"] + width
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "incident_id": incident_id,
+            "bucket": f"{bin_size}{bucket[-1]}",
+            "count": summary["total"],
+            "buckets": summary["buckets"],
+            "key_events": timeline_events_serializer(summary["key_events"]),
+            "key_events_truncated": len(summary["key_events"]) >= MAX_KEY_EVENTS
+        }, headers={"ETag": etag})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error summarizing timeline: {str(e)}")
+
+async def _parse_since(incident_id: str, since: str) -> tuple:
+    """Resolve a since value, either an event ID or an ISO timestamp, to a (timestamp, _id) key"""
+    if ObjectId.is_valid(since):
+        after = await repository.find_timeline_event_key(incident_id, since)
+        if not after:
+            raise HTTPException(status_code=404, detail="Timeline event in 'since' not found for this incident")
+        return after
+    try:
+        return datetime.fromisoformat(since), None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="'since' must be an event ID or an ISO 8601 timestamp")
+
+@router.get("/{incident_id}/stream")
+async def stream_timeline(
+    incident_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None, description="ID of the last change received, to resume after it")
+):
+    """Stream new, updated and deleted timeline events as Server-Sent Events
+    
+    A fresh connection starts with a ready event. A reconnecting client sending
+    Last-Event-ID gets the changes it missed, or a snapshot of the full timeline
+    if they are no longer available. Clients should apply changes by event id.
+    """
+    try:
+        if not ObjectId.is_valid(incident_id):
+            raise HTTPException(status_code=400, detail="Invalid incident ID format")
+        
+        # Verify incident exists
+        incident = await repository.find_incident(incident_id)
+        if not incident:
+            raise HTTPException(status_code=404, detail="Incident not found")
+        
+        async def initial_messages(position: str) -> list:
+            replay = timeline_stream.timeline_broker.replay(incident_id, last_event_id) if last_event_id else []
+            if replay is None:
+                events_list = await repository.find_timeline(incident_id)
+                return [timeline_stream.format_sse("snapshot", position, timeline_events_serializer(events_list))]
+            if last_event_id:
+                return [timeline_stream.format_sse(change["operation"], change["id"], change["event"]) for change in replay]
+            return [timeline_stream.format_sse("ready", position, {"incident_id": incident_id})]
+        
+        return StreamingResponse(
+            timeline_stream.event_stream(request, incident_id, initial_messages),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error streaming timeline: {str(e)}")
+
 @router.put("/{event_id}")
 async def update_timeline_event(event_id: str, updated_event: TimelineEvent):
     """Update a timeline event"""
@@ -69,18 +315,24 @@ async def update_timeline_event(event_id: str, updated_event: TimelineEvent):
         if not ObjectId.is_valid(event_id):
             raise HTTPException(status_code=400, detail="Invalid event ID format")
         
-        existing_event = timeline_collection.find_one({"_id": ObjectId(event_id)})
-        if not existing_event:
-            raise HTTPException(status_code=404, detail="Timeline event not found")
-        
         update_dict = updated_event.dict(exclude_unset=True)
+        # The event may move to another incident, whose summary is refreshed below
+        if "incident_id" in update_dict:
+            if not ObjectId.is_valid(update_dict["incident_id"]):
+                raise HTTPException(status_code=400, detail="Invalid incident ID format")
+            if not await repository.incident_exists(update_dict["incident_id"]):
+                raise HTTPException(status_code=404, detail="Incident not found")
         
-        timeline_collection.update_one(
-            {"_id": ObjectId(event_id)},
-            {"$set": update_dict}
+        previous = await repository.update_timeline_event(event_id, {"$set": update_dict, "$inc": {"version": 1}})
+        if not previous:
+            raise HTTPException(status_code=404, detail="Timeline event not found")
+        updated = {**previous, **update_dict, "version": previous.get("version", 0) + 1}
+        # The event may have moved to another incident, which changes both summaries
+        await repository.refresh_incident_summaries(
+            *{previous["incident_id"], updated["incident_id"]}, bump_version=True
         )
+        timeline_stream.notify(updated["incident_id"], "update", updated)
         
-        updated = timeline_collection.find_one({"_id": ObjectId(event_id)})
         return {
             "status_code": 200,
             "message": "Timeline event updated successfully",
@@ -91,6 +343,50 @@ async def update_timeline_event(event_id: str, updated_event: TimelineEvent):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating timeline event: {str(e)}")
 
+@router.patch("/{event_id}")
+async def patch_timeline_event(event_id: str, changes: TimelineEventUpdate, if_match: Optional[str] = Header(None)):
+    """Update only the given fields of a timeline event
+    
+    Send the version last read, in the body or as an If-Match ETag, to have the
+    update rejected with 412 if the event changed in the meantime.
+    """
+    try:
+        if not ObjectId.is_valid(event_id):
+            raise HTTPException(status_code=400, detail="Invalid event ID format")
+        expected = expected_version(event_id, if_match, changes.version)
+        
+        update_dict = changes.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+        if not update_dict:
+            raise HTTPException(status_code=400, detail="No fields to update")
+        
+        updated = await repository.patch_timeline_event(
+            event_id,
+            {"$set": update_dict, "$inc": {"version": 1}},
+            version_filter(expected)
+        )
+        if not updated:
+            if expected is not None and await repository.timeline_event_exists(event_id):
+                raise HTTPException(status_code=412, detail="Timeline event was modified since the given version")
+            raise HTTPException(status_code=404, detail="Timeline event not found")
+        
+        incident_id = updated["incident_id"]
+        if {"timestamp", "event_type"} & update_dict.keys():
+            # These can change which event is first or last, so rebuild the summary
+            await repository.refresh_incident_summaries(incident_id, bump_version=True)
+        else:
+            await repository.update_incident(incident_id, {"$inc": {"timeline_version": 1}})
+        timeline_stream.notify(incident_id, "update", updated)
+        
+        return ORJSONResponse({
+            "status_code": 200,
+            "message": "Timeline event updated successfully",
+            "data": timeline_event_serializer(updated)
+        }, headers={"ETag": make_etag(event_id, updated.get("version", 0))})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating timeline event: {str(e)}")
+
 @router.delete("/{event_id}")
 async def delete_timeline_event(event_id: str):
     """Delete a timeline event"""
@@ -98,9 +394,11 @@ async def delete_timeline_event(event_id: str):
         if not ObjectId.is_valid(event_id):
             raise HTTPException(status_code=400, detail="Invalid event ID format")
         
-        result = timeline_collection.delete_one({"_id": ObjectId(event_id)})
-        if result.deleted_count == 0:
+        deleted = await repository.delete_timeline_event(event_id)
+        if not deleted:
             raise HTTPException(status_code=404, detail="Timeline event not found")
+        await repository.refresh_incident_summaries(deleted["incident_id"], bump_version=True)
+        timeline_stream.notify(deleted["incident_id"], "delete", deleted)
         
         return {
             "status_code": 200,
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import uuid
+import orjson
+from collections import OrderedDict, deque
+from typing import Optional
+import config
+from config import TIMELINE_STREAM_SOURCE
+from database.schemas import timeline_event_serializer
+
+logger = logging.getLogger(__name__)
+
+# Live timeline changes are fanned out to streaming clients from one broker per
+# worker. Changes reach the broker either from the timeline write paths in this
+# worker ("local") or from a single MongoDB change stream watcher per worker
+# ("change_stream"), which also sees writes made by other workers.
+
+HISTORY_PER_INCIDENT = 500
+MAX_TRACKED_INCIDENTS = 1000
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+class Subscription:
+    """A single streaming client's queue of pending changes"""
+
+    def __init__(self, incident_id: str):
+        self.incident_id = incident_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when the client falls too far behind; it must reconnect and resume
+        self.overflowed = False
+
+    def put(self, change: dict):
+        # Once a change is dropped nothing later is queued, so the stream has no gaps
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+class TimelineBroker:
+    """In-memory pub/sub for timeline changes, keyed by incident
+
+    Every change gets an ID of the form <broker id>-<sequence>. The broker keeps
+    the most recent changes per incident so a reconnecting client that sends
+    its last ID only receives the changes it missed.
+    """
+
+    def __init__(self):
+        self.broker_id = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self._history = OrderedDict()
+        self._subscribers = {}
+
+    def publish(self, incident_id: str, operation: str, event: dict):
+        self._sequence += 1
+        change = {"id": f"{self.broker_id}-{self._sequence}", "operation": operation, "event": event}
+
+        history = self._history.get(incident_id)
+        if history is None:
+            history = self._history[incident_id] = {"changes": deque(), "dropped_through": 0}
+            if len(self._history) > MAX_TRACKED_INCIDENTS:
+                self._history.popitem(last=False)
+        self._history.move_to_end(incident_id)
+        history["changes"].append((self._sequence, change))
+        if len(history["changes"]) > HISTORY_PER_INCIDENT:
+            history["dropped_through"] = history["changes"].popleft()[0]
+
+        for subscription in self._subscribers.get(incident_id, ()):
+            subscription.put(change)
+
+    def position(self) -> str:
+        """ID of the most recent change, for clients to resume from"""
+        return f"{self.broker_id}-{self._sequence}"
+
+    def replay(self, incident_id: str, last_event_id: str) -> Optional[list]:
+        """Changes after last_event_id, or None if they can no longer be reconstructed"""
+        broker_id, _, sequence = last_event_id.partition("-")
+        if broker_id != self.broker_id or not sequence.isdigit():
+            # Issued by another worker or before a restart
+            return None
+        sequence = int(sequence)
+        history = self._history.get(incident_id)
+        if history is None:
+            # Nothing tracked for this incident; only safe if nothing happened since
+            return [] if sequence == self._sequence else None
+        if history["dropped_through"] > sequence:
+            return None
+        return [change for change_sequence, change in history["changes"] if change_sequence > sequence]
+
+    def subscribe(self, incident_id: str) -> Subscription:
+        subscription = Subscription(incident_id)
+        self._subscribers.setdefault(incident_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.incident_id)
+        if subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.incident_id]
+
+    def stats(self) -> dict:
+        return {
+            "source": TIMELINE_STREAM_SOURCE,
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "tracked_incidents": len(self._history)
+        }
+
+timeline_broker = TimelineBroker()
+
+def notify(incident_id: str, operation: str, event: dict):
+    """Publish a change from a timeline write path
+
+    Ignored when the change stream watcher is the source, which would otherwise
+    publish the same change twice.
+    """
+    if TIMELINE_STREAM_SOURCE == "local":
+        timeline_broker.publish(incident_id, operation, timeline_event_serializer(event))
+
+# Server-Sent Events
+KEEPALIVE_SECONDS = 15
+
+def format_sse(event: str, event_id: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\nid: " + event_id.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def event_stream(request, incident_id: str, initial_messages):
+    """Subscribe to an incident, yield the messages initial_messages(position) builds, then each change
+
+    The subscription is made here, not by the endpoint, so it only exists once
+    the body is being streamed and the finally below always removes it.
+    """
+    position = timeline_broker.position()
+    subscription = timeline_broker.subscribe(incident_id)
+    try:
+        # Subscribed first so no change is missed while the initial messages are built
+        for message in await initial_messages(position):
+            yield message
+        while not (subscription.overflowed and subscription.queue.empty()):
+            if await request.is_disconnected():
+                break
+            try:
+                change = await asyncio.wait_for(subscription.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            yield format_sse(change["operation"], change["id"], change["event"])
+        # A client that fell behind is disconnected and resumes from its last ID
+    finally:
+        timeline_broker.unsubscribe(subscription)
+
+# Change stream source
+OPERATIONS = {"insert": "insert", "replace": "update", "update": "update", "delete": "delete"}
+
+async def watch_timeline():
+    """Publish every change to the timeline collection, resuming after errors"""
+    # Deleted events only carry their _id unless pre-images are recorded
+    try:
+        await config.timeline_collection.database.command(
+            "collMod", config.timeline_collection.name, changeStreamPreAndPostImages={"enabled": True}
+        )
+    except Exception as e:
+        logger.warning("Could not enable pre-images; deletes will not be streamed: %s", e)
+    resume_token = None
+    while True:
+        try:
+            async with await config.timeline_collection.watch(
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    operation = OPERATIONS.get(change["operationType"])
+                    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+                    if operation and document:
+                        timeline_broker.publish(document["incident_id"], operation, timeline_event_serializer(document))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Timeline change stream failed, retrying: %s", e)
+            await asyncio.sleep(1)